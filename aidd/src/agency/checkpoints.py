@@ -0,0 +1,190 @@
+"""Content-addressed checkpoints of the project directory.
+
+A checkpoint is a manifest of relative paths to content hashes. File contents are stored once per hash under
+`objects/`, so a checkpoint only adds the blobs of files that changed since earlier ones. Old checkpoints and
+blobs no longer referenced by any checkpoint are removed by `gc`.
+
+Usage
+-----
+python -m agency.checkpoints list
+python -m agency.checkpoints diff CHECKPOINT [OTHER]
+python -m agency.checkpoints restore CHECKPOINT
+"""
+
+import argparse
+import difflib
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+from agency.workspace import snapshot
+from settings import settings
+from sprint import Ticket, TicketStatus
+
+
+class CheckpointStore:
+    def __init__(self, directory: Path, root: Path) -> None:
+        self.directory = directory
+        self.root = root
+
+    def blob_path(self, digest: str) -> Path:
+        return self.directory / "objects" / digest[:2] / digest
+
+    def manifest_path(self, checkpoint: str) -> Path:
+        return self.directory / "manifests" / f"{checkpoint}.json"
+
+    def create(self, label: str) -> str:
+        files = snapshot(self.root)
+        for path, digest in files.items():
+            blob = self.blob_path(digest)
+            if not blob.exists():
+                blob.parent.mkdir(parents=True, exist_ok=True)
+                tmp = blob.with_suffix(".tmp")
+                shutil.copyfile(self.root / path, tmp)
+                tmp.replace(blob)
+
+        checkpoint = f"{time.time_ns() // 1_000_000}_{label}"
+        manifest = self.manifest_path(checkpoint)
+        manifest.parent.mkdir(parents=True, exist_ok=True)
+        manifest.write_text(
+            json.dumps({"label": label, "time": time.time(), "files": files, "dirs": self.directories()})
+        )
+
+        self.gc(keep=settings.checkpoint_keep)
+        return checkpoint
+
+    def load(self, checkpoint: str) -> dict:
+        return json.loads(self.manifest_path(checkpoint).read_text())
+
+    def checkpoints(self) -> list[str]:
+        return sorted(path.stem for path in (self.directory / "manifests").glob("*.json"))
+
+    def directories(self) -> list[str]:
+        directories = []
+        for directory, dirnames, _ in os.walk(self.root):
+            dirnames[:] = [name for name in dirnames if name not in settings.ignore_dirs]
+            directories += [Path(directory, name).relative_to(self.root).as_posix() for name in dirnames]
+
+        return directories
+
+    def restore(self, checkpoint: str) -> list[str]:
+        """Bring the project back to the checkpoint and return the changed paths. Ignored directories are kept."""
+        manifest = self.load(checkpoint)
+        files: dict[str, str] = manifest["files"]
+        current = snapshot(self.root)
+
+        changed = sorted(path for path in files.keys() | current.keys() if files.get(path) != current.get(path))
+        for path in changed:
+            target = self.root / path
+            if path not in files:
+                target.unlink()
+            else:
+                target.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copyfile(self.blob_path(files[path]), target)
+
+        # Directories created after the checkpoint, deepest first
+        known = set(manifest["dirs"])
+        for directory in sorted(set(self.directories()) - known, key=len, reverse=True):
+            path = self.root / directory
+            # Ignored directories inside, e.g. __pycache__ of removed modules, are new as well
+            for name in settings.ignore_dirs:
+                shutil.rmtree(path / name, ignore_errors=True)
+            if not any(path.iterdir()):
+                path.rmdir()
+                changed.append(f"{directory}/")
+
+        for directory in known:
+            (self.root / directory).mkdir(parents=True, exist_ok=True)
+
+        return changed
+
+    def diff(self, checkpoint: str, other: str | None = None) -> str:
+        """Unified diff from a checkpoint to another one or, without `other`, to the current project."""
+        old = self.load(checkpoint)["files"]
+        new = self.load(other)["files"] if other is not None else snapshot(self.root)
+
+        def read(files: dict[str, str], path: str, current: bool) -> list[str] | None:
+            if path not in files:
+                return []
+            content = (self.root / path if current else self.blob_path(files[path])).read_bytes()
+            try:
+                return content.decode().splitlines(keepends=True)
+            except UnicodeDecodeError:
+                return None
+
+        chunks = []
+        for path in sorted(path for path in old.keys() | new.keys() if old.get(path) != new.get(path)):
+            old_lines, new_lines = read(old, path, current=False), read(new, path, current=other is None)
+            if old_lines is None or new_lines is None:
+                chunks.append(f"Binary file {path} changed\n")
+                continue
+            chunks.append(
+                "".join(
+                    difflib.unified_diff(
+                        old_lines,
+                        new_lines,
+                        fromfile=f"a/{path}" if path in old else "/dev/null",
+                        tofile=f"b/{path}" if path in new else "/dev/null",
+                    )
+                )
+            )
+
+        return "".join(chunks)
+
+    def gc(self, keep: int) -> int:
+        """Delete all but the newest `keep` checkpoints and the blobs only they referenced."""
+        checkpoints = self.checkpoints()
+        for checkpoint in checkpoints[: max(len(checkpoints) - keep, 0)]:
+            self.manifest_path(checkpoint).unlink()
+
+        referenced = set()
+        for checkpoint in self.checkpoints():
+            referenced.update(self.load(checkpoint)["files"].values())
+
+        removed = 0
+        for blob in (self.directory / "objects").glob("*/*"):
+            if blob.name not in referenced:
+                blob.unlink()
+                removed += 1
+
+        return removed
+
+
+checkpoint_store = CheckpointStore(settings.state_dir / "checkpoints", settings.project_dir)
+
+
+@contextmanager
+def ticket_checkpoint(ticket: Ticket) -> Iterator[None]:
+    """Roll the project back to its state before the ticket if the ticket failed."""
+    if not settings.rollback_failed_tickets:
+        yield
+        return
+
+    checkpoint = checkpoint_store.create(f"ticket_{ticket.id}")
+    yield
+    if ticket.status == TicketStatus.FAILED:
+        changed = checkpoint_store.restore(checkpoint)
+        print(f"Ticket {ticket.id} failed, rolled back changes of: {', '.join(changed) or 'no files'}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("list", help="List the checkpoints, oldest first.")
+    diff_parser = subparsers.add_parser("diff", help="Diff a checkpoint to another one or the current project.")
+    diff_parser.add_argument("checkpoint")
+    diff_parser.add_argument("other", nargs="?")
+    restore_parser = subparsers.add_parser("restore", help="Restore the project to a checkpoint.")
+    restore_parser.add_argument("checkpoint")
+    args = parser.parse_args()
+
+    if args.command == "list":
+        print("\n".join(checkpoint_store.checkpoints()))
+    elif args.command == "diff":
+        print(checkpoint_store.diff(args.checkpoint, args.other))
+    else:
+        print("\n".join(checkpoint_store.restore(args.checkpoint)))
@@ -0,0 +1,71 @@
+"""Compact tool responses: changed hunks of a file and changes of the directory tree."""
+
+from difflib import SequenceMatcher
+from pathlib import Path
+from typing import Sequence
+
+from agency import utils
+from settings import settings
+
+CONTEXT_LINES = 3
+
+
+def file_delta(path: str, old_content: str, new_content: str, context: int = CONTEXT_LINES) -> str:
+    old_lines = old_content.splitlines()
+    new_lines = new_content.splitlines()
+
+    # Line ranges of the new file to show, merged when their context overlaps
+    ranges: list[list[int]] = []
+    removed = added = 0
+    for tag, i1, i2, j1, j2 in SequenceMatcher(a=old_lines, b=new_lines, autojunk=False).get_opcodes():
+        if tag == "equal":
+            continue
+        removed += i2 - i1
+        added += j2 - j1
+
+        start, end = max(j1 - context, 0), min(j2 + context, len(new_lines))
+        if ranges and start <= ranges[-1][1]:
+            ranges[-1][1] = max(ranges[-1][1], end)
+        else:
+            ranges.append([start, end])
+
+    if not ranges:
+        return f"No changes in {path}."
+
+    hunks = "\n  ...\n".join(
+        "\n".join(f"{i + 1: >3}| {new_lines[i]}" for i in range(start, end)) for start, end in ranges
+    )
+    return f"""\
+Changed lines of {path} (+{added} -{removed}, {len(new_lines)} lines total)
+----------------
+{hunks}
+<<EOF"""
+
+
+def subtree_paths(full_path: Path) -> list[str]:
+    """Paths of a file or directory and everything nested in it, relative to the project directory."""
+    if not full_path.exists():
+        return []
+
+    def relative(path: Path) -> str:
+        name = path.relative_to(utils.project_dir()).as_posix()
+        return f"{name}/" if path.is_dir() else name
+
+    paths = [relative(full_path)]
+    if full_path.is_dir() and full_path.name not in settings.ignore_dirs:
+        for path in sorted(full_path.iterdir()):
+            paths += subtree_paths(path)
+
+    return paths
+
+
+def tree_delta(removed: Sequence[str] = (), added: Sequence[str] = ()) -> str:
+    changes = [f"- {path}" for path in removed] + [f"+ {path}" for path in added]
+    if not changes:
+        return "Directory tree unchanged."
+
+    changes = "\n".join(changes)
+    return f"""\
+Directory Tree Changes
+----------------------
+{changes}"""
@@ -0,0 +1,182 @@
+import os
+import threading
+from pathlib import Path
+
+from agency import utils
+from settings import settings
+
+INDENTATION = " " * 2
+
+
+class Node:
+    def __init__(self, path: Path, is_dir: bool, parent: "Node | None" = None) -> None:
+        self.path = path
+        self.is_dir = is_dir
+        self.parent = parent
+        self.hidden = is_dir and path.name in settings.ignore_dirs
+
+        self.children: dict[str, Node] = {}
+        # Directory mtime at the last scan, changes whenever an entry is added, removed or renamed
+        self.mtime: int | None = None
+        self.rendered: str | None = None
+
+
+class DirTree:
+    """Cached model of the project directory, rendered as the XML tree shown to the coder.
+
+    Directories are only rescanned when their mtime changed or a file tool reports a change, and rendered
+    subtrees are kept until something below them changes. With `watch()`, filesystem events replace the
+    mtime checks on every render.
+    """
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+        self._root_node: Node | None = None
+        self._lock = threading.RLock()
+
+        self._observer = None
+        # Set by filesystem events, only relevant while watching
+        self._dirty = True
+
+    def render(self) -> str:
+        with self._lock:
+            if self._root_node is None:
+                self._root_node = Node(self.root, is_dir=True)
+                self._validate(self._root_node)
+            elif self._observer is None or self._dirty:
+                self._dirty = False
+                self._validate(self._root_node)
+
+            return self._render(self._root_node, indent=0)
+
+    def update(self, path: Path) -> None:
+        """Refresh the tree after `path` was created, changed, moved or removed."""
+        with self._lock:
+            if self._root_node is None:
+                return
+
+            node = self._root_node
+            for part in path.relative_to(self.root).parent.parts:
+                child = node.children.get(part)
+                if child is None or not child.is_dir or child.hidden:
+                    break
+                node = child
+
+            self._validate(node, force=True)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._root_node = None
+
+    def close(self) -> None:
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer = None
+
+    ### Filesystem events ###
+
+    def watch(self) -> None:
+        try:
+            from watchdog.events import FileSystemEventHandler
+            from watchdog.observers import Observer
+        except ImportError:
+            print("watchdog is not installed, the directory tree is validated on every render instead.")
+            return
+
+        tree = self
+
+        class Handler(FileSystemEventHandler):
+            def on_any_event(self, event) -> None:
+                # Content changes and file access do not affect the tree
+                if event.event_type in ("created", "deleted", "moved"):
+                    tree._dirty = True
+
+        self._observer = Observer()
+        self._observer.schedule(Handler(), str(self.root), recursive=True)
+        self._observer.daemon = True
+        self._observer.start()
+
+    ### Internals ###
+
+    def _scan(self, node: Node) -> None:
+        """Read the entries of a directory, keeping the nodes of entries that still exist."""
+        node.mtime = node.path.stat().st_mtime_ns
+        children = {}
+        with os.scandir(node.path) as entries:
+            for entry in entries:
+                is_dir = entry.is_dir()
+                child = node.children.get(entry.name)
+                if child is None or child.is_dir != is_dir:
+                    child = Node(Path(entry.path), is_dir=is_dir, parent=node)
+                children[entry.name] = child
+
+        node.children = children
+        self._mark_changed(node)
+
+    def _validate(self, node: Node, force: bool = False) -> None:
+        try:
+            mtime = node.path.stat().st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+
+        if mtime is None:
+            if node.parent is not None:
+                self._validate(node.parent, force=True)
+            return
+
+        if force or mtime != node.mtime:
+            self._scan(node)
+
+        for child in node.children.values():
+            if child.is_dir and not child.hidden:
+                self._validate(child)
+
+    def _mark_changed(self, node: Node | None) -> None:
+        while node is not None and node.rendered is not None:
+            node.rendered = None
+            node = node.parent
+
+    def _render(self, node: Node, indent: int) -> str:
+        if node.rendered is not None:
+            return node.rendered
+
+        name = node.path.name if indent > 0 else "."
+        prefix = INDENTATION * indent
+
+        if not node.is_dir:
+            node.rendered = f"{prefix}<file name='{name}'/>"
+        elif node.hidden:
+            node.rendered = f"{prefix}<dir name='{name}' hidden />"
+        else:
+            nested = sorted(node.children.values(), key=lambda child: (not child.is_dir, child.path.name))
+            content = "\n".join([self._render(child, indent=indent + 1) for child in nested])
+            if not content:
+                node.rendered = f"{prefix}<dir name='{name}' empty />"
+            else:
+                node.rendered = f"{prefix}<dir name='{name}'>\n{content}\n{prefix}</dir>"
+
+        return node.rendered
+
+
+dir_trees: dict[Path, DirTree] = {}
+dir_trees_lock = threading.Lock()
+
+
+def get_dir_tree() -> DirTree:
+    """Tree of the current project directory, see `utils.project_dir`."""
+    root = utils.project_dir()
+    with dir_trees_lock:
+        if root not in dir_trees:
+            dir_trees[root] = DirTree(root)
+            if settings.dir_tree_watch:
+                dir_trees[root].watch()
+
+        return dir_trees[root]
+
+
+def drop_dir_tree(root: Path) -> None:
+    with dir_trees_lock:
+        tree = dir_trees.pop(root, None)
+
+    if tree is not None:
+        tree.close()
@@ -0,0 +1,127 @@
+"""Edits of many line ranges across files in one tool call, applied all together or not at all.
+
+Hunks refer to the line numbers of the files as they were before the call, as shown by `read_file`, so they do not
+shift when an earlier hunk of the same file adds or removes lines.
+"""
+
+import os
+import shutil
+from pathlib import Path
+
+from agency import utils
+from pydantic import BaseModel, Field
+
+
+class Hunk(BaseModel):
+    path: str = Field(description="Path of the file to change.")
+    start_line: int = Field(description="First line to replace, in the line numbers before any hunk is applied.")
+    end_line: int = Field(description="Last line to replace; start_line - 1 inserts before start_line.")
+    new_code: str = Field(description="Code replacing the lines, with indents; empty to remove them.")
+
+    def label(self) -> str:
+        return f"{self.path} {self.start_line}-{self.end_line}"
+
+
+class EditError(ValueError):
+    pass
+
+
+def validate_hunks(hunks: list[Hunk], line_counts: dict[str, int]) -> list[str]:
+    """Problems of the hunks, given the line counts of the files they change. Hunks of files without a line count
+    are skipped, the caller reports them as missing."""
+    problems = []
+    last_hunk: dict[str, Hunk] = {}
+    for number, hunk in sorted(enumerate(hunks, start=1), key=lambda item: hunk_order(item[1])):
+        count = line_counts.get(hunk.path)
+        if count is None:
+            continue
+
+        if not 1 <= hunk.start_line <= count + 1 or not hunk.start_line - 1 <= hunk.end_line <= count:
+            problems.append(f"Hunk {number} ({hunk.label()}): lines out of range, the file has {count} lines.")
+            continue
+
+        previous = last_hunk.get(hunk.path)
+        if previous is not None and hunk.start_line <= previous.end_line:
+            problems.append(f"Hunk {number} ({hunk.label()}): overlaps hunk {previous.label()}.")
+            continue
+
+        last_hunk[hunk.path] = hunk
+
+    return problems
+
+
+def hunk_order(hunk: Hunk) -> tuple[str, int, int]:
+    # Insertions before replacements starting at the same line, a stable sort keeps the given order of insertions
+    return hunk.path, hunk.start_line, hunk.end_line
+
+
+def apply_hunks(content: str, hunks: list[Hunk]) -> str:
+    """Apply validated, non-overlapping hunks of one file, from the bottom up so earlier line numbers stay valid."""
+    lines = content.splitlines()
+    for hunk in reversed(sorted(hunks, key=hunk_order)):
+        lines[hunk.start_line - 1 : hunk.end_line] = hunk.new_code.splitlines()
+
+    new_content = "\n".join(lines)
+    if content.endswith("\n") and lines:
+        new_content += "\n"
+
+    return new_content
+
+
+def edit_files(hunks: list[Hunk]) -> dict[str, tuple[str, str]]:
+    """Apply the hunks to their files, returns the old and new content by path.
+
+    Raises `EditError` listing all missing files and invalid hunks before any file is written. Files are replaced
+    one by one, if replacing one fails, the files replaced before are restored.
+    """
+    if not hunks:
+        raise EditError("No hunks given.")
+
+    full_paths: dict[str, Path] = {}
+    contents: dict[str, str] = {}
+    problems = []
+    normalized = []
+    for hunk in hunks:
+        full_path = utils.validate_path(hunk.path)
+        # Different spellings of the same path, e.g. "./app.py", refer to the same file
+        path = full_path.relative_to(utils.project_dir()).as_posix()
+        if path not in full_paths:
+            if full_path.is_file():
+                full_paths[path] = full_path
+                contents[path] = full_path.read_text()
+            elif f"File {path} does not exist." not in problems:
+                problems.append(f"File {path} does not exist.")
+        normalized.append(hunk.model_copy(update={"path": path}))
+    hunks = normalized
+
+    problems += validate_hunks(hunks, {path: len(content.splitlines()) for path, content in contents.items()})
+    if problems:
+        problems = "\n".join(problems)
+        raise EditError(f"{problems}\nNo file was changed.")
+
+    changes = {
+        path: (content, apply_hunks(content, [hunk for hunk in hunks if hunk.path == path]))
+        for path, content in contents.items()
+    }
+
+    # Written next to the files first, so a failed write leaves every file untouched
+    temporary_paths = {path: full_paths[path].with_name(f".{full_paths[path].name}.edit") for path in changes}
+    try:
+        for path, (_, new_content) in changes.items():
+            temporary_paths[path].write_text(new_content)
+            shutil.copymode(full_paths[path], temporary_paths[path])
+
+        replaced = []
+        try:
+            for path in changes:
+                os.replace(temporary_paths[path], full_paths[path])
+                replaced.append(path)
+        except OSError:
+            for path in replaced:
+                full_paths[path].write_text(changes[path][0])
+            raise
+    finally:
+        for temporary_path in temporary_paths.values():
+            temporary_path.unlink(missing_ok=True)
+
+    return changes
@@ -0,0 +1,56 @@
+"""Line-numbered renderings of files as shown by `read_file`, cached by path, mtime and size.
+
+Reading an unchanged file again, or another range of it, takes its rendered lines from the cache instead of
+numbering the whole file again.
+"""
+
+import bisect
+import itertools
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+# Rendered files kept, least recently read ones are dropped first
+CACHE_SIZE = 128
+
+
+class RenderedFile:
+    def __init__(self, content: str) -> None:
+        self.lines = [f"{i + 1: >3}| {line}" for i, line in enumerate(content.splitlines())]
+        # Byte offsets of the line ends in the joined rendering, to cut pages at a size
+        self.ends = list(itertools.accumulate(len(line.encode()) + 1 for line in self.lines))
+
+    def page(self, start_line: int, end_line: int, max_bytes: int) -> tuple[str, int]:
+        """Rendered lines from `start_line` up to `end_line` (1 based, inclusive) that fit into `max_bytes`.
+
+        Returns the text and the last line shown. A first line too large on its own is cut, e.g. of minified code.
+        """
+        offset = self.ends[start_line - 2] if start_line > 1 else 0
+        last_line = bisect.bisect_right(self.ends, offset + max_bytes, lo=start_line - 1, hi=end_line)
+        if last_line < start_line:
+            line = self.lines[start_line - 1].encode()[:max_bytes].decode(errors="ignore")
+            return f"{line} ... (line cut at {max_bytes} bytes)", start_line
+
+        return "\n".join(self.lines[start_line - 1 : last_line]), last_line
+
+
+rendered_files: OrderedDict[Path, tuple[int, int, RenderedFile]] = OrderedDict()
+rendered_files_lock = threading.Lock()
+
+
+def rendered_file(full_path: Path) -> RenderedFile:
+    stat = full_path.stat()
+    with rendered_files_lock:
+        cached = rendered_files.get(full_path)
+        if cached is not None and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            rendered_files.move_to_end(full_path)
+            return cached[2]
+
+    rendered = RenderedFile(full_path.read_text())
+    with rendered_files_lock:
+        rendered_files[full_path] = (stat.st_mtime_ns, stat.st_size, rendered)
+        rendered_files.move_to_end(full_path)
+        while len(rendered_files) > CACHE_SIZE:
+            rendered_files.popitem(last=False)
+
+    return rendered
@@ -1,19 +1,38 @@
+import asyncio
+import contextvars
 import shutil
-import subprocess
+import threading
+import uuid
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextvars import ContextVar
 from pathlib import Path
-from typing import Annotated
-
-from agency import utils
-from agency.lpu.standard import base_config
+from typing import Annotated, Sequence
+
+from agency import edits, session, static_check, test_impact, test_worker, utils, wheelhouse
+from agency.checkpoints import ticket_checkpoint
+from agency.deltas import file_delta, subtree_paths, tree_delta
+from agency.dir_tree import drop_dir_tree, get_dir_tree
+from agency.edits import Hunk
+from agency.file_view import rendered_file
+from agency.lpu import base_config, response_cache, setup_agent
+from agency.memory import HistoryCompactor, summarize_ticket
+from agency.progress import ProgressMonitor
+from agency.symbols import SymbolKind, drop_symbol_index, get_symbol_index
+from agency.tool_cache import cached, tool_cache
+from agency.workspace import MergeConflictError, Workspace, snapshot, tree_hash
 from autogen import Agent, AssistantAgent, GroupChat, GroupChatManager, UserProxyAgent
+from backlog import backlog
 from settings import settings
-from sprint import Sprint, TicketStatus
+from sprint import Sprint, Ticket, TicketStatus
+from tracing import instrument_llm, instrument_tools, traced_chat, traced_tool, tracer
+
+EDITOR_AUTO_REPLY = "Only submit the ticket, if you are sure that the implementation is correct."
 
 editor_proxy = UserProxyAgent(
     name="Editor",
     human_input_mode="NEVER",
     code_execution_config=False,
-    default_auto_reply="Only submit the ticket, if you are sure that the implementation is correct.",
+    default_auto_reply=EDITOR_AUTO_REPLY,
 )
 
 coder = AssistantAgent(
@@ -43,49 +62,134 @@ Repeat these steps for each ticket you are facing.""",
 @editor_proxy.register_for_execution()
 @coder.register_for_llm(description="Show the directory tree of the project.")
 def show_dir_tree() -> str:
-    indentation = " " * 2
-
-    def xml_dir_tree(current: Path, indent: int = 0) -> str:
-        name = current.name if indent > 0 else "."
-        prefix = indentation * indent
-
-        if current.is_file():
-            return f"{prefix}<file name='{name}'/>"
+    return f"""\
+Working Directory
+-----------------
+{get_dir_tree().render()}"""
 
-        if current.name in settings.ignore_dirs:
-            return f"{prefix}<dir name='{name}' hidden />"
 
-        nested = sorted(current.iterdir(), key=lambda p: (p.is_file(), p.name))
-        content = "\n".join([xml_dir_tree(subpath, indent=indent + 1) for subpath in nested])
-        if not content:
-            return f"{prefix}<dir name='{name}' empty />"
+def file_update_response(path: str, old_content: str, new_content: str) -> str:
+    if settings.edit_response_mode == "verbose":
+        return read_file(path)
 
-        return f"{prefix}<dir name='{name}'>\n{content}\n{prefix}</dir>"
+    return file_delta(path, old_content, new_content)
 
-    return f"""\
-Working Directory
------------------
-{xml_dir_tree(settings.project_dir)}"""
 
+def tree_update_response(removed: Sequence[str] = (), added: Sequence[str] = ()) -> str:
+    if settings.edit_response_mode == "verbose":
+        return show_dir_tree()
 
-def format_lines(content: str) -> str:
-    return "\n".join([f"{i + 1: >3}| {line}" for i, line in enumerate(content.splitlines())])
+    return tree_delta(removed=removed, added=added)
 
 
 @editor_proxy.register_for_execution()
-@coder.register_for_llm(description="Read the content of a file.")
-def read_file(path: str) -> str:
+@coder.register_for_llm(
+    description="Read the content of a file, optionally only a range of lines. Large files are shown in pages."
+)
+def read_file(
+    path: str,
+    start_line: Annotated[int, "First line to show."] = 1,
+    end_line: Annotated[int | None, "Last line to show, the end of the file by default."] = None,
+    max_bytes: Annotated[int | None, "Size limit of the shown lines, a default limit applies otherwise."] = None,
+) -> str:
     full_path = utils.validate_path(path)
-    content = full_path.read_text()
-    if not content:
+    rendered = rendered_file(full_path)
+    line_count = len(rendered.lines)
+    if not line_count:
         return f"File {path} is empty."
 
-    return f"""\
+    end_line = line_count if end_line is None else min(end_line, line_count)
+    if not 1 <= start_line <= end_line:
+        raise ValueError(f"Invalid line range {start_line}-{end_line}, {path} has {line_count} lines.")
+
+    content, last_line = rendered.page(start_line, end_line, max_bytes or settings.read_file_max_bytes)
+    if (start_line, last_line) == (1, line_count):
+        return f"""\
 Content of {path}
 ----------------
-{format_lines(content)}
+{content}
 <<EOF"""
 
+    continuation = ""
+    if last_line < end_line:
+        continuation = f"\nLines {last_line + 1}-{end_line} not shown, continue with start_line={last_line + 1}."
+
+    return f"""\
+Content of {path} (lines {start_line}-{last_line} of {line_count})
+----------------
+{content}
+<<EOF{continuation}"""
+
+
+SEARCH_LIMIT = 50
+DEFINITION_LINES = 40
+
+
+@editor_proxy.register_for_execution()
+@coder.register_for_llm(
+    description="Search the Python code of the project for functions, classes, methods, routes (e.g. 'GET /users'), "
+    "imports and call sites by name, instead of reading whole files. Matches parts of names, ignoring case."
+)
+def search_code(
+    query: Annotated[str, "Part of the name, e.g. 'user' or 'UserService.create'."],
+    kind: Annotated[SymbolKind | None, "Only symbols of this kind, e.g. 'call' to find the callers."] = None,
+) -> str:
+    index = get_symbol_index()
+    symbols = index.search(query, kind)
+    results = "\n".join(symbol.render() for symbol in symbols[:SEARCH_LIMIT]) or "No symbols found."
+    if len(symbols) > SEARCH_LIMIT:
+        results += f"\n... {len(symbols) - SEARCH_LIMIT} more, refine the query or filter by kind."
+    if index.errors:
+        results += f"\n\nNot indexed, syntax errors: {', '.join(sorted(index.errors))}"
+
+    return f"""\
+Symbols matching '{query}'
+----------------
+{results}"""
+
+
+@editor_proxy.register_for_execution()
+@coder.register_for_llm(
+    description="Go to the definition of a function, class or method by name and show its code and call sites."
+)
+def go_to_definition(
+    name: Annotated[str, "Name of the symbol, optionally qualified like 'UserService.create'."],
+) -> str:
+    index = get_symbol_index()
+    definitions = index.definitions(name)
+    if not definitions:
+        raise ValueError(f"No definition of {name} found, search_code finds symbols by parts of their name.")
+
+    sections = []
+    for symbol in definitions:
+        lines = rendered_file(utils.validate_path(symbol.path)).lines
+        end_line = min(symbol.end_line, symbol.line + DEFINITION_LINES - 1)
+        code = "\n".join(lines[symbol.line - 1 : end_line])
+        if end_line < symbol.end_line:
+            code += f"\n  ... {symbol.end_line - end_line} more lines, read_file for the rest"
+
+        calls = index.calls(symbol)
+        call_sites = ", ".join(f"{call.path}:{call.line}" for call in calls[:SEARCH_LIMIT]) or "none"
+        sections.append(f"{symbol.render()}\n{code}\n<<EOF\nCall sites: {call_sites}")
+
+    # Calls no definition of the name could be attributed to, e.g. on parameters of unknown type
+    called_name = definitions[0].name
+    attributed = {call for symbol in index.definitions(called_name) for call in index.calls(symbol)}
+    others = [
+        call
+        for call in index.search(called_name, SymbolKind.CALL)
+        if call.name == called_name and call not in attributed
+    ]
+    if others:
+        other_sites = ", ".join(f"{call.path}:{call.line}" for call in others[:SEARCH_LIMIT])
+        sections.append(f"Other calls named {called_name}: {other_sites}")
+    sections = "\n\n".join(sections)
+
+    return f"""\
+Definition of {name}
+----------------
+{sections}"""
+
 
 @editor_proxy.register_for_execution()
 @coder.register_for_llm(
@@ -147,23 +251,62 @@ def modify_file(
     new_content = "\n".join(lines)
 
     full_path.write_text(new_content)
+    get_symbol_index().update(full_path)
 
     return f"""\
 Content of {path} has been updated.
 
-{read_file(path)}"""
+{file_update_response(path, content, new_content)}{static_check.check_response([full_path])}"""
+
+
+@editor_proxy.register_for_execution()
+@coder.register_for_llm(
+    description="""\
+Change several places of one or more files in a single call, like `modify_file` for many line ranges.
+All line numbers refer to the files as they are before this call, e.g. as last shown by `read_file`;
+they do not shift when another hunk adds or removes lines. Hunks of a file must not overlap.
+Either all hunks are applied or, if any is invalid, none.
+
+Example: rename a parameter in its function and in a call further down
+
+hunks: [
+  {"path": "app/main.py", "start_line": 4, "end_line": 4, "new_code": "def get_user(user_id: int):"},
+  {"path": "app/main.py", "start_line": 20, "end_line": 20, "new_code": "    return get_user(user_id=1)"},
+  {"path": "app/models.py", "start_line": 1, "end_line": 0, "new_code": "from datetime import datetime"}
+]
+
+Note: end_line = start_line - 1 inserts before start_line without replacing anything"""
+)
+def edit_files(hunks: Annotated[list[Hunk], "Line ranges to replace, in any order."]) -> str:
+    # Autogen only converts arguments annotated with a model itself, not lists of them
+    hunks = [Hunk.model_validate(hunk) for hunk in hunks]
+    changes = edits.edit_files(hunks)
+    full_paths = [utils.validate_path(path) for path in changes]
+    for full_path in full_paths:
+        get_symbol_index().update(full_path)
+    responses = "\n\n".join(
+        file_update_response(path, old_content, new_content) for path, (old_content, new_content) in changes.items()
+    )
+
+    return f"""\
+Applied {len(hunks)} hunks to {len(changes)} files.
+
+{responses}{static_check.check_response(full_paths)}"""
 
 
 @editor_proxy.register_for_execution()
 @coder.register_for_llm(description="Overwrite the content of a file with new content. The old content will be lost.")
 def overwrite_file(path: str, new_content: Annotated[str, "New content of the file."]) -> str:
     full_path = utils.validate_path(path)
+    content = full_path.read_text() if full_path.is_file() else ""
     full_path.write_text(new_content)
+    get_dir_tree().update(full_path)
+    get_symbol_index().update(full_path)
 
     return f"""\
 Content of {path} has been updated.
 
-{read_file(path)}"""
+{file_update_response(path, content, new_content)}{static_check.check_response([full_path])}"""
 
 
 @editor_proxy.register_for_execution()
@@ -173,25 +316,38 @@ Content of {path} has been updated.
 def create_file(path: str, initial_content: Annotated[str, "Initial content of the file."] = "") -> str:
     full_path = utils.validate_path(path)
     full_path.write_text(initial_content)
+    get_dir_tree().update(full_path)
+    get_symbol_index().update(full_path)
 
-    return f"""\
+    if settings.edit_response_mode == "verbose":
+        return f"""\
 File {path} created.
 
 {show_dir_tree()}
 
-{read_file(path)}"""
+{read_file(path)}{static_check.check_response([full_path])}"""
+
+    return f"""\
+File {path} created with {len(initial_content.splitlines())} lines.
+
+{tree_delta(added=subtree_paths(full_path))}{static_check.check_response([full_path])}"""
 
 
 @editor_proxy.register_for_execution()
 @coder.register_for_llm(description="Create an empty directory.")
 def create_dir(path: str) -> str:
     full_path = utils.validate_path(path)
+    # Topmost directory that does not exist yet, missing parents are created as well
+    created_path = full_path
+    while not created_path.parent.exists():
+        created_path = created_path.parent
     full_path.mkdir(parents=True)
+    get_dir_tree().update(created_path)
 
     return f"""\
 Directory {path} created.
 
-{show_dir_tree()}"""
+{tree_update_response(added=subtree_paths(created_path))}"""
 
 
 @editor_proxy.register_for_execution()
@@ -200,80 +356,162 @@ def move_path(source: str, destination: str) -> str:
     source_path = utils.validate_path(source)
     destination_path = utils.validate_path(destination)
 
-    shutil.move(source_path, destination_path)
+    moved_paths = subtree_paths(source_path)
+    moved_to = Path(shutil.move(source_path, destination_path))
+    get_dir_tree().update(source_path)
+    get_dir_tree().update(moved_to)
+    get_symbol_index().update(source_path)
+    get_symbol_index().update(moved_to)
 
     return f"""\
 {source} moved to {destination}.
 
-{show_dir_tree()}"""
+{tree_update_response(removed=moved_paths, added=subtree_paths(moved_to))}"""
 
 
 @editor_proxy.register_for_execution()
 @coder.register_for_llm(description="Delete a file or directory with all its content.")
 def delete_path(path: str) -> str:
     full_path = utils.validate_path(path)
+    removed_paths = subtree_paths(full_path)
     if full_path.is_file():
         full_path.unlink()
     else:
         shutil.rmtree(full_path)
+    get_dir_tree().update(full_path)
+    get_symbol_index().update(full_path)
 
     return f"""\
 {path} removed.
 
-{show_dir_tree()}"""
+{tree_update_response(removed=removed_paths)}"""
 
 
-@editor_proxy.register_for_execution()
-@coder.register_for_llm(description="Pip install one or more packages. (separate by space or '-r requirements.txt')")
-def pip_install(packages: str) -> str:
-    result = subprocess.run(
-        ["pip", "install", *packages.split()], capture_output=True, text=True, cwd=settings.project_dir
+def pip_succeeded(result: str) -> bool:
+    # Failures, e.g. of the network or the resolver, are not cached so that a retry runs pip again
+    return not result.startswith("Pip failed")
+
+
+@cached("pip_install", store=pip_succeeded)
+async def a_pip_install(packages: str) -> str:
+    output, installed, succeeded = await asyncio.to_thread(
+        wheelhouse.pip_install, packages.split(), cwd=utils.project_dir()
     )
-    output = result.stdout or result.stderr
+    if installed:
+        # Warm test workers and cached test results may depend on old versions of the installed packages
+        test_worker.restart_workers()
+        tool_cache.new_environment()
+
     return f"""\
-Pip output
+Pip {"output" if succeeded else "failed"}
 ----------
 {output}"""
 
 
+@cached("run_tests", depends_on_environment=True, bypass=lambda arguments: arguments["isolated"])
+async def a_run_tests(paths: str = "", isolated: bool = False, affected: bool = False) -> str:
+    impact_map = test_impact.get_impact_map(utils.project_dir())
+    args = paths.split()
+    mode = "paths" if args else "all"
+    selection_note = ""
+    if affected and not args:
+        selected, reason = await asyncio.to_thread(impact_map.select)
+        if selected is None:
+            selection_note = f"Running all tests, {reason}.\n"
+        elif not selected:
+            return f"""\
+Test output
+-----------
+No tests affected, {reason}."""
+        else:
+            args, mode = selected, "affected"
+            selection_note = f"Running {len(selected)} affected test files, {reason}.\n"
+
+    # Project state the tests run on; it becomes the baseline of affected runs if all tests pass
+    before = await asyncio.to_thread(snapshot, utils.project_dir())
+    report_path = settings.state_dir / "test_impact" / "reports" / f"{uuid.uuid4().hex}.json"
+    args += test_impact.plugin_args(report_path)
+    env = test_impact.plugin_env()
+
+    output = None
+    if settings.test_worker and not isolated:
+        output = await asyncio.to_thread(
+            test_worker.run_pytest, args, cwd=utils.project_dir(), preload=settings.test_worker_preload, env=env
+        )
+    if output is None:
+        output = await utils.run_command("pytest", *args, env=env)
+    await asyncio.to_thread(impact_map.update, report_path, mode, before)
+
+    return f"""\
+Test output
+-----------
+{selection_note}{output}"""
+
+
+@editor_proxy.register_for_execution()
+@coder.register_for_llm(description="Pip install one or more packages. (separate by space or '-r requirements.txt')")
+def pip_install(packages: str) -> str:
+    return asyncio.run(a_pip_install(packages))
+
+
 @editor_proxy.register_for_execution()
 @coder.register_for_llm(
     description="Run pytest for the project. Optionally provide paths to run tests for specific files."
 )
-def run_tests(paths: str = "") -> str:
-    result = subprocess.run(["pytest", *paths.split()], capture_output=True, text=True, cwd=settings.project_dir)
-    output = result.stdout or result.stderr
-    return f"""\
-Test output
------------
-{output}"""
+def run_tests(
+    paths: str = "",
+    isolated: Annotated[bool, "Run in a fresh Python process, e.g. when tests depend on interpreter state."] = False,
+    affected: Annotated[bool, "Only run the tests affected by changes since the last passing run."] = False,
+) -> str:
+    return asyncio.run(a_run_tests(paths, isolated, affected))
 
 
-editor_exit = False
+# Set for every ticket chat, so that tickets worked on in parallel do not end each other's chats. An event
+# instead of a flag, tools may run in a copy of the chat's context
+editor_exit: ContextVar[threading.Event] = ContextVar("editor_exit")
+# Set for every ticket chat as well, watching the coder for repeated calls on the same project state
+ticket_progress: ContextVar[ProgressMonitor] = ContextVar("ticket_progress")
 
 
 @editor_proxy.register_for_execution()
 @coder.register_for_llm(description="Submit the current state of the project as the final solution to the ticket.")
 def submit_ticket() -> str:
-    global editor_exit
     # Update object
-    editor_exit = True
+    editor_exit.get().set()
 
     return "Ticket submitted."
 
 
 ### Group Chat ###
 
+# Registering tools rebuilds the LLM client, so the backend is set up once all tools are known
+setup_agent(coder)
+instrument_llm(coder)
+instrument_tools(editor_proxy)
+
+
+def register_async_tools(editor: UserProxyAgent) -> None:
+    """Execute long-running tools as coroutines, so they do not block the event loop of the async orchestration."""
+    editor.register_function(
+        {
+            "pip_install": traced_tool(editor.name, "pip_install", a_pip_install),
+            "run_tests": traced_tool(editor.name, "run_tests", a_run_tests),
+        },
+        silent_override=True,
+    )
+
 
 def speaker_selection(last_speaker: Agent, groupchat: GroupChat) -> Agent | None:
-    global editor_exit
-    if editor_exit:
+    if editor_exit.get().is_set() or ticket_progress.get().stop_reason is not None:
         return None
 
-    if last_speaker == coder:
-        return editor_proxy
+    editor, developer = groupchat.agents
+    if last_speaker == developer:
+        # The editor still answers the calls, the chat history of the team has to stay valid for the next ticket
+        ticket_progress.get().observe(groupchat.messages[-1])
+        return editor
 
-    return coder
+    return developer
 
 
 planning_group = GroupChat(
@@ -285,6 +523,299 @@ planning_group = GroupChat(
 chat_manager = GroupChatManager(
     groupchat=planning_group,
 )
+coder_memory = HistoryCompactor(coder, chat_manager, token_budget=settings.history_token_budget.get(coder.name))
+session.track_chat("implementation", planning_group, chat_manager, coder_memory)
+
+
+class Team:
+    """Coder and editor with the group chat they work on tickets in."""
+
+    def __init__(
+        self,
+        coder: AssistantAgent,
+        editor: UserProxyAgent,
+        groupchat: GroupChat,
+        manager: GroupChatManager,
+        memory: HistoryCompactor,
+    ) -> None:
+        self.coder = coder
+        self.editor = editor
+        self.groupchat = groupchat
+        self.manager = manager
+        self.memory = memory
+
+
+team = Team(coder, editor_proxy, planning_group, chat_manager, coder_memory)
+
+
+def create_team() -> Team:
+    """Independent copy of the team with its own chat history, for tickets worked on in parallel."""
+    team_coder = AssistantAgent(name=coder.name, llm_config=coder.llm_config, system_message=coder.system_message)
+    setup_agent(team_coder)
+    instrument_llm(team_coder)
+
+    team_editor = UserProxyAgent(
+        name=editor_proxy.name,
+        human_input_mode="NEVER",
+        code_execution_config=False,
+        default_auto_reply=EDITOR_AUTO_REPLY,
+    )
+    # Tools resolve paths against the project directory of the current context, so they can be shared
+    team_editor.register_function(editor_proxy.function_map)
+
+    groupchat = GroupChat(
+        agents=[team_editor, team_coder],
+        messages=[],
+        max_round=planning_group.max_round,
+        speaker_selection_method=speaker_selection,
+    )
+    manager = GroupChatManager(groupchat=groupchat)
+    memory = HistoryCompactor(team_coder, manager, token_budget=coder_memory.token_budget)
+    return Team(team_coder, team_editor, groupchat, manager, memory)
+
+
+### Tickets ###
+
+
+def ticket_message(sprint: Sprint, ticket: Ticket) -> str:
+    return f"""\
+A new sprint has started. Solve the tickets you have been assigned to.
+
+Current Sprint Goal
+-------------------
+{sprint.goal}
+
+You received a new ticket assigned to you:
+
+Ticket
+------
+{ticket.model_dump_json(indent=2)}
+
+This is a file editor to make the necessary changes to the code base.
+
+{show_dir_tree()}"""
+
+
+def complete_ticket(ticket: Ticket) -> TicketStatus:
+    if editor_exit.get().is_set():
+        ticket.status = TicketStatus.DONE
+    else:
+        ticket.status = TicketStatus.FAILED
+
+    backlog.set_status(ticket.id, ticket.status.value)
+    return ticket.status
+
+
+def run_ticket(sprint: Sprint, ticket: Ticket, team: Team = team) -> None:
+    # Reset result object
+    editor_exit.set(threading.Event())
+    ticket_progress.set(ProgressMonitor("implementation", state=lambda: tree_hash(utils.project_dir())))
+    with tracer.scope(ticket=ticket.id), traced_chat("implementation", team.groupchat) as span:
+        team.manager.initiate_chat(
+            recipient=team.coder,
+            clear_history=False,
+            cache=response_cache,
+            max_turns=100,
+            message=ticket_message(sprint, ticket),
+        )
+        span["status"] = complete_ticket(ticket).value
+        span["early_exit"] = ticket_progress.get().stop_reason
+
+    team.memory.compact(summarize_ticket(ticket, team.memory.chat_messages()))
+
+
+async def a_run_ticket(sprint: Sprint, ticket: Ticket, team: Team = team) -> None:
+    # Reset result object
+    editor_exit.set(threading.Event())
+    ticket_progress.set(ProgressMonitor("implementation", state=lambda: tree_hash(utils.project_dir())))
+    with tracer.scope(ticket=ticket.id), traced_chat("implementation", team.groupchat) as span:
+        await team.manager.a_initiate_chat(
+            recipient=team.coder,
+            clear_history=False,
+            cache=response_cache,
+            max_turns=100,
+            message=ticket_message(sprint, ticket),
+        )
+        span["status"] = complete_ticket(ticket).value
+        span["early_exit"] = ticket_progress.get().stop_reason
+
+    team.memory.compact(summarize_ticket(ticket, team.memory.chat_messages()))
+
+
+### Parallel Execution ###
+
+# Workspaces are created from and merged into the project directory one at a time
+workspace_lock = threading.Lock()
+
+
+def create_workspace(ticket: Ticket) -> Workspace:
+    directory = (settings.state_dir / "workspaces" / f"ticket_{ticket.id}").resolve()
+    workspace = Workspace(settings.project_dir, directory)
+    with workspace_lock:
+        workspace.create()
+
+    return workspace
+
+
+def merge_workspace(ticket: Ticket, workspace: Workspace) -> None:
+    """Merge the changes of a done ticket into the project, changes of failed tickets are discarded.
+
+    Raises `MergeConflictError` if a ticket merged in the meantime changed the same files.
+    """
+    if ticket.status != TicketStatus.DONE:
+        return
+
+    with workspace_lock:
+        changed_paths = workspace.merge()
+    print(f"Ticket {ticket.id} merged: {', '.join(changed_paths) or 'no changes'}")
+
+
+def remove_workspace(workspace: Workspace) -> None:
+    drop_dir_tree(workspace.directory)
+    drop_symbol_index(workspace.directory)
+    workspace.remove()
+
+
+def run_ticket_in_workspace(sprint: Sprint, ticket: Ticket) -> None:
+    """Work on the ticket with its own team in a copy of the project."""
+    workspace = create_workspace(ticket)
+    try:
+        with utils.use_project_dir(workspace.directory):
+            run_ticket(sprint, ticket, create_team())
+        merge_workspace(ticket, workspace)
+    finally:
+        remove_workspace(workspace)
+
+
+async def a_run_ticket_in_workspace(sprint: Sprint, ticket: Ticket) -> None:
+    workspace = await asyncio.to_thread(create_workspace, ticket)
+    try:
+        with utils.use_project_dir(workspace.directory):
+            await a_run_ticket(sprint, ticket, create_team())
+        await asyncio.to_thread(merge_workspace, ticket, workspace)
+    finally:
+        await asyncio.to_thread(remove_workspace, workspace)
+
+
+class TicketScheduler:
+    """Hands out the tickets of a sprint as soon as their dependencies are finished."""
+
+    def __init__(self, tickets: list[Ticket]) -> None:
+        self.tickets = list(tickets)
+        self.pending = list(tickets)
+        self.open_ids = {ticket.id for ticket in tickets}
+        self.finished: set[int] = set()
+        # Tickets repeated one after another once the others are done
+        self.deferred: set[int] = set()
+
+    def is_ready(self, ticket: Ticket) -> bool:
+        # Dependencies outside of the sprint are already done or will never be
+        return all(
+            dependency in self.finished or dependency not in self.open_ids for dependency in ticket.depends_on
+        )
+
+    def next_tickets(self, slots: int, idle: bool) -> list[Ticket]:
+        ready = [ticket for ticket in self.pending if self.is_ready(ticket)]
+        if not ready and idle:
+            # Circular dependencies, continue in the planned order
+            ready = self.pending[:1]
+
+        ready = ready[:slots]
+        for ticket in ready:
+            self.pending.remove(ticket)
+
+        return ready
+
+    def finish(self, ticket: Ticket) -> None:
+        self.finished.add(ticket.id)
+
+    def defer(self, ticket: Ticket) -> list[Ticket]:
+        """Hold back the ticket and the pending tickets building on it, directly or not, returns the latter."""
+        self.deferred.add(ticket.id)
+        dependents = []
+        changed = True
+        while changed:
+            changed = False
+            for pending in list(self.pending):
+                if self.deferred.intersection(pending.depends_on):
+                    self.pending.remove(pending)
+                    self.deferred.add(pending.id)
+                    dependents.append(pending)
+                    changed = True
+
+        return dependents
+
+    def deferred_tickets(self) -> list[Ticket]:
+        # Planned order, dependencies before the tickets building on them
+        return [ticket for ticket in self.tickets if ticket.id in self.deferred]
+
+
+def requeue_conflicted(ticket: Ticket, error: MergeConflictError, scheduler: TicketScheduler) -> None:
+    print(f"Ticket {ticket.id} is repeated after the other tickets. {error}")
+    ticket.status = TicketStatus.TODO
+    backlog.set_status(ticket.id, ticket.status.value)
+    # Tickets building on it would start in workspaces without its changes
+    for dependent in scheduler.defer(ticket):
+        print(f"Ticket {dependent.id} is held back until ticket {ticket.id} is repeated.")
+
+
+def run_parallel(sprint: Sprint) -> None:
+    """Work on all tickets whose dependencies are finished at the same time.
+
+    Tickets that conflict with changes merged in the meantime are repeated one after another at the end, together
+    with the tickets depending on them.
+    """
+    scheduler = TicketScheduler(sprint.open_tickets)
+    running: dict[Future, Ticket] = {}
+
+    with ThreadPoolExecutor(max_workers=settings.max_parallel_tickets) as executor:
+        while scheduler.pending or running:
+            slots = settings.max_parallel_tickets - len(running)
+            for ticket in scheduler.next_tickets(slots, idle=not running):
+                context = contextvars.copy_context()
+                running[executor.submit(context.run, run_ticket_in_workspace, sprint, ticket)] = ticket
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                ticket = running.pop(future)
+                try:
+                    future.result()
+                except MergeConflictError as e:
+                    requeue_conflicted(ticket, e, scheduler)
+                else:
+                    scheduler.finish(ticket)
+                session.save()
+
+    for ticket in scheduler.deferred_tickets():
+        with ticket_checkpoint(ticket):
+            run_ticket(sprint, ticket)
+        session.save()
+
+
+async def a_run_parallel(sprint: Sprint) -> None:
+    scheduler = TicketScheduler(sprint.open_tickets)
+    running: dict[asyncio.Task, Ticket] = {}
+
+    while scheduler.pending or running:
+        slots = settings.max_parallel_tickets - len(running)
+        for ticket in scheduler.next_tickets(slots, idle=not running):
+            running[asyncio.create_task(a_run_ticket_in_workspace(sprint, ticket))] = ticket
+
+        done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            ticket = running.pop(task)
+            try:
+                task.result()
+            except MergeConflictError as e:
+                requeue_conflicted(ticket, e, scheduler)
+            else:
+                scheduler.finish(ticket)
+            session.save()
+
+    for ticket in scheduler.deferred_tickets():
+        with ticket_checkpoint(ticket):
+            await a_run_ticket(sprint, ticket)
+        session.save()
 
 
 ### Main Functions ###
@@ -306,36 +837,23 @@ Project Request
 
 def run_implementation(sprint: Sprint) -> None:
     """Execute all tickets of the current sprint. When all tickets are done, evaluate the sprint and give a retrospective."""
-    global editor_exit
-
-    sprint_intro_message = f"""\
-A new sprint has started. Solve the tickets you have been assigned to.
-
-Current Sprint Goal
--------------------
-{sprint.goal}
-
-"""
+    if settings.max_parallel_tickets > 1:
+        run_parallel(sprint)
+        return
 
     for ticket in sprint.open_tickets:
-        # Reset result object
-        editor_exit = False
-        chat_manager.initiate_chat(
-            recipient=coder,
-            clear_history=False,
-            max_turns=100,
-            message=f"""{sprint_intro_message}\
-You received a new ticket assigned to you:
+        with ticket_checkpoint(ticket):
+            run_ticket(sprint, ticket)
+        session.save()
 
-Ticket
-------
-{ticket.model_dump_json(indent=2)}
 
-This is a file editor to make the necessary changes to the code base.
+async def a_run_implementation(sprint: Sprint) -> None:
+    """Async variant of `run_implementation`, requires `register_async_tools(editor_proxy)`."""
+    if settings.max_parallel_tickets > 1:
+        await a_run_parallel(sprint)
+        return
 
-{show_dir_tree()}""",
-        )
-        if editor_exit:
-            ticket.status = TicketStatus.DONE
-        else:
-            ticket.status = TicketStatus.FAILED
+    for ticket in sprint.open_tickets:
+        with ticket_checkpoint(ticket):
+            await a_run_ticket(sprint, ticket)
+        session.save()
@@ -0,0 +1,16 @@
+from settings import settings
+
+if settings.llm_backend == "offline":
+    from agency.lpu.offline import base_config, backend_state, restore_backend_state, setup_agent, setup_human
+
+    # Scripted replies are stateful, serving them from the response cache would desync the script
+    response_cache = None
+else:
+    from agency.lpu.standard import (
+        backend_state,
+        base_config,
+        response_cache,
+        restore_backend_state,
+        setup_agent,
+        setup_human,
+    )
@@ -0,0 +1,143 @@
+import hashlib
+import json
+import os
+import pickle
+import time
+from pathlib import Path
+from typing import Any
+
+# Request fields that determine the completion; everything else (api keys, base urls, ...) is ignored.
+CACHE_KEY_FIELDS = ("model", "temperature", "messages", "tools")
+
+
+class CacheMissError(Exception):
+    pass
+
+
+class ResponseCache:
+    """On-disk LLM response cache, content-addressed by the request that produced the response.
+
+    Follows autogen's cache protocol and is handed to the agents via `initiate_chat(cache=...)`.
+    """
+
+    def __init__(self, directory: Path, max_size: int, max_age: float, replay_only: bool = False) -> None:
+        self.directory = directory
+        self.max_size = max_size
+        self.max_age = max_age
+        self.replay_only = replay_only
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._size = sum(path.stat().st_size for path in self._entries())
+        self.evict()
+
+    ### Autogen cache protocol ###
+
+    def __enter__(self) -> "ResponseCache":
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb) -> None:
+        # The cache is shared by all requests of the session, keep it open.
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        digest = self.content_key(key)
+        path = self._path(digest)
+
+        if path.is_file() and not self._is_expired(path):
+            try:
+                value = pickle.loads(path.read_bytes())
+            except (OSError, EOFError, pickle.UnpicklingError):
+                self._remove(path)
+            else:
+                # Refresh mtime so eviction drops the least recently used entries first
+                path.touch()
+                self.hits += 1
+                return value
+
+        self.misses += 1
+        if self.replay_only:
+            raise CacheMissError(f"Replay-only mode: no cached response for request {digest}.")
+
+        return default
+
+    def set(self, key: Any, value: Any) -> None:
+        if self.replay_only:
+            return
+
+        path = self._path(self.content_key(key))
+        path.parent.mkdir(exist_ok=True)
+        if path.is_file():
+            self._size -= path.stat().st_size
+
+        data = pickle.dumps(value)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_bytes(data)
+        tmp_path.replace(path)
+        self._size += len(data)
+
+        if self._size > self.max_size:
+            self.evict()
+
+    ### Maintenance ###
+
+    @staticmethod
+    def content_key(key: Any) -> str:
+        if isinstance(key, str):
+            try:
+                key = json.loads(key)
+            except json.JSONDecodeError:
+                key = {"request": key}
+
+        request = {field: key.get(field) for field in CACHE_KEY_FIELDS} if isinstance(key, dict) else key
+        payload = json.dumps(request, sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def evict(self) -> None:
+        """Drop expired entries, then the least recently used ones until the cache fits its size limit."""
+        entries = sorted(self._entries(), key=lambda path: path.stat().st_mtime)
+
+        for path in entries:
+            if self._is_expired(path) or self._size > self.max_size:
+                self._remove(path)
+                self.evictions += 1
+
+    def stats(self) -> dict[str, int | float]:
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / requests if requests else 0.0,
+            "size_bytes": self._size,
+        }
+
+    def summary(self) -> str:
+        stats = self.stats()
+        return (
+            f"LLM cache: {stats['hits']} hits, {stats['misses']} misses ({stats['hit_rate']:.0%} hit rate), "
+            f"{stats['evictions']} evictions, {stats['size_bytes'] / 2**20:.1f} MiB on disk."
+        )
+
+    def _path(self, digest: str) -> Path:
+        return self.directory / digest[:2] / f"{digest}.pkl"
+
+    def _entries(self) -> list[Path]:
+        return list(self.directory.glob("*/*.pkl"))
+
+    def _is_expired(self, path: Path) -> bool:
+        return time.time() - path.stat().st_mtime > self.max_age
+
+    def _remove(self, path: Path) -> None:
+        try:
+            size = path.stat().st_size
+            path.unlink()
+        except FileNotFoundError:
+            return
+        self._size -= size
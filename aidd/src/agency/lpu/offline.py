@@ -0,0 +1,258 @@
+"""Offline LLM backend serving scripted or recorded completions instead of calling OpenAI.
+
+The script is a JSON object mapping agent names to lists of steps:
+
+    {
+        "SoftwarePlanner": [
+            {"tool_calls": [{"name": "init_sprint_plan", "arguments": {"goal": "..."}}]},
+            {"content": "Plan looks good."}
+        ],
+        "Coder": [{"match": "Test output", "tool_calls": [{"name": "submit_ticket"}]}],
+        "User": ["Approved.", "exit"]
+    }
+
+Steps without "match" form the transcript and are served once, in order.
+Steps with "match" are rules: a regex matched against the last message, reusable and only used
+when the transcript of the agent is exhausted. Steps of the "User" agent answer human input prompts.
+"""
+
+import json
+import re
+import uuid
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any
+
+from agency.utils import estimate_tokens
+from autogen import ConversableAgent
+from settings import settings
+
+HUMAN_AGENT = "User"
+
+config_list = [
+    {
+        "model": "offline",
+        "model_client_cls": "OfflineClient",
+    }
+]
+
+
+base_config = {
+    "config_list": config_list,
+    "cache_seed": None,
+    "temperature": 0,
+}
+
+
+class ScriptExhaustedError(Exception):
+    pass
+
+
+class Script:
+    def __init__(self, steps: dict[str, list[Any]]) -> None:
+        self.transcripts = {
+            agent: [step for step in agent_steps if not isinstance(step, dict) or "match" not in step]
+            for agent, agent_steps in steps.items()
+        }
+        self.rules = {
+            agent: [step for step in agent_steps if isinstance(step, dict) and "match" in step]
+            for agent, agent_steps in steps.items()
+        }
+        # Transcript steps served per agent
+        self.served: dict[str, int] = {}
+
+    @classmethod
+    def load(cls, path: Path) -> "Script":
+        return cls(json.loads(path.read_text()))
+
+    def next_step(self, agent: str, last_message: str) -> Any:
+        transcript = self.transcripts.get(agent, [])
+        if transcript:
+            self.served[agent] = self.served.get(agent, 0) + 1
+            return transcript.pop(0)
+
+        for rule in self.rules.get(agent, []):
+            if re.search(rule["match"], last_message):
+                return rule
+
+        raise ScriptExhaustedError(f"Offline script has no reply left for {agent} on: {last_message[:200]!r}")
+
+    def skip(self, agent: str, steps: int) -> None:
+        del self.transcripts.get(agent, [])[:steps]
+        self.served[agent] = self.served.get(agent, 0) + steps
+
+
+script: Script | None = None
+
+
+def get_script() -> Script:
+    global script
+    if script is None:
+        script = Script.load(settings.offline_script)
+
+    return script
+
+
+def backend_state() -> dict:
+    """Steps of the script served so far, a resumed session continues the script after them."""
+    return {"served": dict(get_script().served)}
+
+
+def restore_backend_state(state: dict) -> None:
+    for agent, steps in state.get("served", {}).items():
+        get_script().skip(agent, steps)
+
+
+def message_text(message: dict) -> str:
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        content = "\n".join(part.get("text", "") for part in content if isinstance(part, dict))
+
+    return content
+
+
+class OfflineClient:
+    """Autogen model client, registered per agent so the script can tell the agents apart."""
+
+    def __init__(self, config: dict, agent_name: str, **kwargs: Any) -> None:
+        self.model = config.get("model", "offline")
+        self.agent_name = agent_name
+
+    def create(self, params: dict) -> SimpleNamespace:
+        messages = params.get("messages", [])
+        last_message = message_text(messages[-1]) if messages else ""
+        step = get_script().next_step(self.agent_name, last_message)
+        if isinstance(step, str):
+            step = {"content": step}
+
+        tool_calls = [
+            {
+                "id": f"call_{uuid.uuid4().hex[:24]}",
+                "type": "function",
+                "function": {"name": call["name"], "arguments": json.dumps(call.get("arguments", {}))},
+            }
+            for call in step.get("tool_calls", [])
+        ]
+        message = {"role": "assistant", "content": step.get("content")}
+        if tool_calls:
+            message["tool_calls"] = tool_calls
+
+        prompt_tokens = sum(estimate_tokens(message_text(m)) for m in messages)
+        prompt_tokens += estimate_tokens(json.dumps(params.get("tools", [])))
+        completion_tokens = estimate_tokens(json.dumps(message))
+
+        return SimpleNamespace(
+            id=f"offline-{uuid.uuid4().hex}",
+            model=self.model,
+            choices=[SimpleNamespace(message=message, finish_reason="tool_calls" if tool_calls else "stop")],
+            usage=SimpleNamespace(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                total_tokens=prompt_tokens + completion_tokens,
+            ),
+            cost=0.0,
+            message_retrieval_function=None,
+        )
+
+    def message_retrieval(self, response: SimpleNamespace) -> list[str | dict]:
+        return [
+            choice.message if choice.message.get("tool_calls") else (choice.message["content"] or "")
+            for choice in response.choices
+        ]
+
+    def cost(self, response: SimpleNamespace) -> float:
+        return 0.0
+
+    @staticmethod
+    def get_usage(response: SimpleNamespace) -> dict:
+        return {
+            "prompt_tokens": response.usage.prompt_tokens,
+            "completion_tokens": response.usage.completion_tokens,
+            "total_tokens": response.usage.total_tokens,
+            "cost": 0.0,
+            "model": response.model,
+        }
+
+
+def setup_agent(agent: ConversableAgent) -> None:
+    agent.register_model_client(model_client_cls=OfflineClient, agent_name=agent.name)
+
+
+def setup_human(agent: ConversableAgent) -> None:
+    """Answer human input prompts of the agent from the script instead of stdin."""
+
+    def get_human_input(prompt: str, **kwargs: Any) -> str:
+        try:
+            reply = get_script().next_step(HUMAN_AGENT, prompt)
+        except ScriptExhaustedError:
+            reply = "exit"
+
+        if isinstance(reply, dict):
+            reply = reply.get("content", "")
+
+        print(f"{prompt}{reply}")
+        return reply
+
+    async def a_get_human_input(prompt: str, **kwargs: Any) -> str:
+        return get_human_input(prompt, **kwargs)
+
+    agent.get_human_input = get_human_input
+    agent.a_get_human_input = a_get_human_input
+    if settings.transcript_file is not None:
+        record_human(agent)
+
+
+### Recording ###
+
+human_replies: list[str] = []
+
+
+def record_human(agent: ConversableAgent) -> None:
+    """Keep the human input of the agent, chat messages do not show replies like 'exit' or empty ones."""
+    get_human_input = agent.get_human_input
+
+    def recording_get_human_input(prompt: str, **kwargs: Any) -> str:
+        reply = get_human_input(prompt, **kwargs)
+        human_replies.append(reply)
+        return reply
+
+    a_get_human_input = agent.a_get_human_input
+
+    async def recording_a_get_human_input(prompt: str, **kwargs: Any) -> str:
+        reply = await a_get_human_input(prompt, **kwargs)
+        human_replies.append(reply)
+        return reply
+
+    agent.get_human_input = recording_get_human_input
+    agent.a_get_human_input = recording_a_get_human_input
+
+
+def transcript_from_messages(messages: list[dict], agents: list[str]) -> dict[str, list[Any]]:
+    """Convert group chat messages of a recorded session into a replayable script for the given agents."""
+    steps: dict[str, list[Any]] = {}
+
+    for message in messages:
+        name = message.get("name")
+        if name not in agents or message.get("role") == "tool" or "tool_responses" in message:
+            continue
+
+        step: dict[str, Any] = {}
+        if message.get("content"):
+            step["content"] = message_text(message)
+        if message.get("tool_calls"):
+            step["tool_calls"] = [
+                {"name": call["function"]["name"], "arguments": json.loads(call["function"]["arguments"] or "{}")}
+                for call in message["tool_calls"]
+            ]
+        if step:
+            steps.setdefault(name, []).append(step)
+
+    return steps
+
+
+def save_transcript(messages: list[dict], agents: list[str], path: Path) -> None:
+    transcript = transcript_from_messages(messages, agents)
+    transcript[HUMAN_AGENT] = list(human_replies)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(transcript, indent=2))
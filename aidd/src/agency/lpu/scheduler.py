@@ -0,0 +1,282 @@
+"""Rate limits of the LLM requests of all agents, shared by all threads of the process.
+
+Every model with limits in `settings.llm_rate_limits` gets a token bucket for its requests and one for its tokens per
+minute. Requests wait in a queue per model until both buckets hold enough, those of interactive phases (planning,
+where the user waits for the plan) before those of background phases (implementation). Rate limit errors of the API
+are retried with jittered exponential backoff, and pause the whole queue of the model for the time the API asks for.
+
+With `settings.llm_rate_limit_file`, the bucket levels and pauses are kept in that file under a file lock, so that
+several processes using the same API key, e.g. the sessions of a batch run, stay within the limits together. Each
+process also records the priority of its first waiting request there, and requests yield to more urgent ones
+waiting in other processes.
+"""
+
+import fcntl
+import functools
+import heapq
+import itertools
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+from agency.utils import estimate_tokens
+from autogen import OpenAIWrapper
+from openai import RateLimitError
+from settings import settings
+from tracing import scope_attributes, tracer
+
+# Lower is served first, requests outside of a phase are interactive
+PHASE_PRIORITIES = {"planning": 0, "implementation": 1}
+# Seconds between checks whether more urgent requests of other processes are still waiting
+YIELD_INTERVAL = 0.2
+
+
+class TokenBucket:
+    """Holds up to `capacity` units, refilled by `rate` units per second. Not thread-safe.
+
+    The level may drop below zero when a request used more tokens than it reserved, later requests wait for the debt.
+    """
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        self.rate = rate
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Seconds until `amount` can be taken, amounts beyond the capacity wait for a full bucket."""
+        self.refill(now)
+        return max(0.0, (min(amount, self.capacity) - self.level) / self.rate)
+
+    def take(self, amount: float) -> None:
+        self.level -= amount
+
+
+class ModelQueue:
+    """Requests waiting for the rate limits of one model, in order of priority and arrival."""
+
+    def __init__(
+        self,
+        requests_per_minute: float = 0,
+        tokens_per_minute: float = 0,
+        model: str = "",
+        state_file: Path | None = None,
+    ) -> None:
+        self.requests = TokenBucket(requests_per_minute / 60, requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute / 60, tokens_per_minute) if tokens_per_minute else None
+        self.paused_until = 0.0
+        self.model = model
+        self.state_file = state_file
+        # Priority of the first waiting request of other processes sharing the state file, by process ID
+        self.others_waiting: dict[str, int] = {}
+
+        self._waiting: list[tuple[int, int]] = []
+        self._arrivals = itertools.count()
+        self._condition = threading.Condition()
+
+    def buckets(self) -> dict[str, TokenBucket]:
+        buckets = {"requests": self.requests, "tokens": self.tokens}
+        return {name: bucket for name, bucket in buckets.items() if bucket is not None}
+
+    @contextmanager
+    def shared_state(self) -> Iterator[None]:
+        """Take over the levels other processes left in the state file, and store the changed ones back."""
+        if self.state_file is None:
+            yield
+            return
+
+        self.state_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.state_file, "a+") as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            file.seek(0)
+            states = json.loads(file.read() or "{}")
+            state = states.get(self.model, {})
+            # The monotonic clock is the same for all processes of the machine
+            now = time.monotonic()
+            self.paused_until = state.get("paused_until", self.paused_until)
+            for name, bucket in self.buckets().items():
+                if name in state:
+                    bucket.level, bucket.updated = state[name][0], min(state[name][1], now)
+            pid = str(os.getpid())
+            self.others_waiting = {
+                other: priority
+                for other, priority in state.get("waiting", {}).items()
+                if other != pid and process_alive(int(other))
+            }
+
+            yield
+
+            waiting = dict(self.others_waiting)
+            if self._waiting:
+                waiting[pid] = self._waiting[0][0]
+            states[self.model] = {
+                "paused_until": self.paused_until,
+                "waiting": waiting,
+                **{name: [bucket.level, bucket.updated] for name, bucket in self.buckets().items()},
+            }
+            file.seek(0)
+            file.truncate()
+            file.write(json.dumps(states))
+
+    def wait_time(self, tokens: int, now: float, priority: int = 0) -> float:
+        wait = self.paused_until - now
+        if self.requests is not None:
+            wait = max(wait, self.requests.wait_time(1, now))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(tokens, now))
+        if any(other < priority for other in self.others_waiting.values()):
+            wait = max(wait, YIELD_INTERVAL)
+
+        return max(0.0, wait)
+
+    def acquire(self, tokens: int, priority: int) -> float:
+        """Wait until the request is first in line and within the limits, returns the seconds waited."""
+        start = time.monotonic()
+        entry = (priority, next(self._arrivals))
+        with self._condition:
+            heapq.heappush(self._waiting, entry)
+            while True:
+                # Only the first request in line waits for the buckets, the others for their turn
+                wait = None
+                if self._waiting[0] == entry:
+                    with self.shared_state():
+                        wait = self.wait_time(tokens, time.monotonic(), priority)
+                        if wait == 0:
+                            if self.requests is not None:
+                                self.requests.take(1)
+                            if self.tokens is not None:
+                                self.tokens.take(tokens)
+                            # Popped before the state is stored, so other processes stop yielding to it
+                            heapq.heappop(self._waiting)
+                            break
+                self._condition.wait(wait)
+
+            self._condition.notify_all()
+
+        return time.monotonic() - start
+
+    def settle(self, reserved: int, used: int) -> None:
+        """Correct the reserved estimate of a request by the tokens it actually used."""
+        if self.tokens is None:
+            return
+
+        with self._condition:
+            with self.shared_state():
+                self.tokens.take(used - reserved)
+            self._condition.notify_all()
+
+    def release(self, tokens: int) -> None:
+        """Return the reservation of a request the API rejected, its retry reserves again."""
+        with self._condition:
+            with self.shared_state():
+                if self.requests is not None:
+                    self.requests.take(-1)
+                if self.tokens is not None:
+                    self.tokens.take(-tokens)
+            self._condition.notify_all()
+
+    def pause(self, seconds: float) -> None:
+        with self._condition:
+            with self.shared_state():
+                self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self._condition.notify_all()
+
+
+class Scheduler:
+    def __init__(
+        self,
+        limits: dict[str, dict[str, float]],
+        max_retries: int,
+        backoff: float = 1.0,
+        max_backoff: float = 60.0,
+        state_file: Path | None = None,
+    ) -> None:
+        self.limits = limits
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.state_file = state_file
+
+        self._queues: dict[str, ModelQueue] = {}
+        self._lock = threading.Lock()
+
+    def queue(self, model: str) -> ModelQueue:
+        with self._lock:
+            if model not in self._queues:
+                self._queues[model] = ModelQueue(**self.limits.get(model, {}), model=model, state_file=self.state_file)
+
+            return self._queues[model]
+
+    def create(self, params: dict[str, Any], create: Callable[[dict[str, Any]], Any]) -> Any:
+        """Send a request of a model client once the limits of its model allow, retrying rate limit errors."""
+        model = params.get("model", "")
+        phase = scope_attributes.get().get("phase")
+        priority = PHASE_PRIORITIES.get(phase, 0)
+        labels = {"model": model, "phase": phase or "none"}
+
+        queue = self.queue(model)
+        # Completion tokens are unknown up front, the reservation is settled with the usage of the response
+        tokens = estimate_tokens(json.dumps([params.get("messages", []), params.get("tools", [])], default=str))
+        for attempt in itertools.count():
+            tracer.observe("aidd_llm_queue_seconds", queue.acquire(tokens, priority), **labels)
+            try:
+                response = create(params)
+            except RateLimitError as e:
+                tracer.inc("aidd_llm_rate_limited_total", **labels)
+                queue.release(tokens)
+                if attempt >= self.max_retries:
+                    raise
+
+                retry_after = retry_after_seconds(e)
+                queue.pause(retry_after)
+                # Jitter spreads the retries of requests limited at the same time
+                time.sleep(retry_after + random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt)))
+                continue
+
+            usage = getattr(response, "usage", None)
+            queue.settle(tokens, getattr(usage, "total_tokens", None) or tokens)
+            return response
+
+    def wrap(self, client: OpenAIWrapper) -> None:
+        """Send all requests of the wrapper's model clients through the scheduler.
+
+        The model clients are wrapped, not the wrapper, so responses served from the response cache are not limited.
+        Call again whenever the agent's client is rebuilt.
+        """
+        for model_client in client._clients:
+            model_client.create = functools.partial(self.create, create=model_client.create)
+
+
+def process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+def retry_after_seconds(error: RateLimitError) -> float:
+    """Wait time the API asks for, from the `retry-after-ms` or `retry-after` header."""
+    headers = error.response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        return float(headers.get("retry-after", 0))
+    except ValueError:
+        # `retry-after` may also be an HTTP date, the backoff has to do
+        return 0.0
+
+
+scheduler = Scheduler(settings.llm_rate_limits, settings.llm_max_retries, state_file=settings.llm_rate_limit_file)
@@ -0,0 +1,171 @@
+"""Stand-in for the OpenAI chat completions API with rate limits, to try the scheduler without spending tokens.
+
+The server answers every request with a fixed reply after some latency, or with status 429 and a `retry-after-ms`
+header once its requests or tokens per minute are used up, like the real API. Point the standard backend at it with
+`OPENAI_BASE_URL=http://127.0.0.1:8099/v1`.
+
+`load` starts a server and sends requests of the planning and implementation phase through a scheduler at the same
+time, then prints how long the requests of each phase waited and how many were rejected by the server.
+
+Usage
+-----
+python -m agency.lpu.stand_in serve [--port N] [--requests-per-minute N] [--tokens-per-minute N] [--latency S]
+python -m agency.lpu.stand_in load [--requests N] [--threads N] [--limit-requests-per-minute N] [...]
+"""
+
+import argparse
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from agency.lpu.scheduler import Scheduler, TokenBucket
+from agency.utils import estimate_tokens
+from autogen import OpenAIWrapper
+from tracing import tracer
+
+MODEL = "gpt-4o-mini"
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self, port: int, requests_per_minute: float, tokens_per_minute: float, latency: float, reply: str
+    ) -> None:
+        super().__init__(("127.0.0.1", port), StandInHandler)
+        self.requests = TokenBucket(requests_per_minute / 60, requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute / 60, tokens_per_minute)
+        self.latency = latency
+        self.reply = reply
+
+        self.served = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def admit(self, tokens: int) -> float:
+        """Take the request from the buckets, or return the seconds until it would fit."""
+        with self.lock:
+            now = time.monotonic()
+            wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+            if wait > 0:
+                self.rejected += 1
+                return wait
+
+            self.requests.take(1)
+            self.tokens.take(tokens)
+            self.served += 1
+            return 0.0
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    server: StandInServer
+
+    def do_POST(self) -> None:
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        prompt_tokens = estimate_tokens(json.dumps([body.get("messages", []), body.get("tools", [])]))
+        completion_tokens = estimate_tokens(self.server.reply)
+
+        wait = self.server.admit(prompt_tokens + completion_tokens)
+        if wait > 0:
+            error = {"error": {"message": "Rate limit reached.", "type": "requests", "code": "rate_limit_exceeded"}}
+            self.respond(429, error, {"retry-after-ms": str(int(wait * 1000) + 1)})
+            return
+
+        time.sleep(self.server.latency)
+        self.respond(
+            200,
+            {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", MODEL),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": self.server.reply},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens,
+                },
+            },
+        )
+
+    def respond(self, status: int, data: dict, headers: dict[str, str] | None = None) -> None:
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format: str, *args: object) -> None:
+        pass
+
+
+def run_load(server: StandInServer, scheduler: Scheduler, requests: int, threads: int) -> None:
+    client = OpenAIWrapper(
+        config_list=[
+            {
+                "model": MODEL,
+                "api_key": "stand-in",
+                "base_url": f"http://127.0.0.1:{server.server_port}/v1",
+                "max_retries": 0,
+            }
+        ],
+        cache_seed=None,
+    )
+    scheduler.wrap(client)
+
+    def request(number: int) -> None:
+        # One in four requests is interactive, as while the user waits for a sprint plan
+        with tracer.scope(phase="planning" if number % 4 == 0 else "implementation"):
+            client.create(messages=[{"role": "user", "content": f"Request {number}. " + "Lorem ipsum. " * 50}])
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        list(executor.map(request, range(requests)))
+    wall_time = time.perf_counter() - start
+
+    print(f"{requests} requests in {wall_time:.1f}s, {server.rejected} rejected by the server.")
+    for phase in ("planning", "implementation"):
+        labels = (("model", MODEL), ("phase", phase))
+        count = tracer.metrics.get("aidd_llm_queue_seconds_count", {}).get(labels, 0)
+        waited = tracer.metrics.get("aidd_llm_queue_seconds_sum", {}).get(labels, 0)
+        limited = tracer.metrics.get("aidd_llm_rate_limited_total", {}).get(labels, 0)
+        print(f"{phase:<16}{count:>6.0f} attempts, {waited / max(count, 1):6.2f}s mean wait, {limited:>4.0f} rejected")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=["serve", "load"])
+    parser.add_argument("--port", type=int, default=8099, help="0 picks a free port.")
+    parser.add_argument("--requests-per-minute", type=float, default=60)
+    parser.add_argument("--tokens-per-minute", type=float, default=20000)
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds before each reply.")
+    parser.add_argument("--reply", default="TERMINATE")
+    parser.add_argument("--requests", type=int, default=40, help="load: requests to send.")
+    parser.add_argument("--threads", type=int, default=8, help="load: requests sent at the same time.")
+    parser.add_argument("--limit-requests-per-minute", type=float, default=0, help="load: scheduler limit.")
+    parser.add_argument("--limit-tokens-per-minute", type=float, default=0, help="load: scheduler limit.")
+    args = parser.parse_args()
+
+    server = StandInServer(args.port, args.requests_per_minute, args.tokens_per_minute, args.latency, args.reply)
+    if args.command == "serve":
+        print(f"Serving on http://127.0.0.1:{server.server_port}/v1")
+        server.serve_forever()
+    else:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        limits = {
+            "requests_per_minute": args.limit_requests_per_minute,
+            "tokens_per_minute": args.limit_tokens_per_minute,
+        }
+        run_load(server, Scheduler({MODEL: limits}, max_retries=10), args.requests, args.threads)
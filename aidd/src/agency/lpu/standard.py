@@ -1,9 +1,16 @@
+from agency.lpu.cache import ResponseCache
+from agency.lpu.offline import record_human
+from agency.lpu.scheduler import scheduler
+from autogen import ConversableAgent
 from settings import settings
 
 config_list = [
     {
         "model": settings.openai_model_name,
         "api_key": settings.openai_api_key,
+        # Rate limit errors are retried by the scheduler, which knows about the other requests waiting
+        "max_retries": 0,
+        **({"base_url": settings.openai_base_url} if settings.openai_base_url else {}),
     }
 ]
 
@@ -14,6 +21,38 @@ base_config = {
     "temperature": 0,
 }
 
+# Passed to every `initiate_chat`; autogen's own `cache_seed` cache stays disabled in favour of this one.
+response_cache = (
+    ResponseCache(
+        directory=settings.state_dir / "llm_cache",
+        max_size=settings.llm_cache_max_size_mb * 2**20,
+        max_age=settings.llm_cache_max_age_days * 24 * 60 * 60,
+        replay_only=settings.llm_cache_mode == "replay",
+    )
+    if settings.llm_cache_mode != "off"
+    else None
+)
+
+
+def setup_agent(agent: ConversableAgent) -> None:
+    # OpenAI clients are created by autogen from `base_config`, their requests wait for the rate limits
+    scheduler.wrap(agent.client)
+
+
+def setup_human(agent: ConversableAgent) -> None:
+    # Human input is read from stdin, keep it when the session is recorded for offline replay
+    if settings.transcript_file is not None:
+        record_human(agent)
+
+
+def backend_state() -> dict:
+    # Responses are cached on disk, a resumed session needs no state of the backend
+    return {}
+
+
+def restore_backend_state(state: dict) -> None:
+    pass
+
 
 TERMINATION_SYMBOL = "TERMINATE"
 
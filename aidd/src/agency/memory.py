@@ -0,0 +1,153 @@
+import json
+from typing import Any
+
+from agency.utils import estimate_tokens
+from autogen import Agent, ConversableAgent
+from sprint import Sprint, Ticket
+from tracing import tracer
+
+SUMMARY_PREFIX = "Summary of "
+
+
+def message_tokens(message: dict) -> int:
+    content = message.get("content") or ""
+    if not isinstance(content, str):
+        content = json.dumps(content, default=str)
+
+    return estimate_tokens(content) + estimate_tokens(json.dumps(message.get("tool_calls") or [], default=str))
+
+
+def group_messages(messages: list[dict]) -> list[list[dict]]:
+    """Group tool call requests with their responses, the LLM API rejects one without the other."""
+    groups: list[list[dict]] = []
+    for message in messages:
+        if message.get("role") == "tool" and groups:
+            groups[-1].append(message)
+        else:
+            groups.append([message])
+
+    return groups
+
+
+class HistoryCompactor:
+    """Keeps the chat history of an agent bounded.
+
+    Finished chats (tickets, sprint plannings) are replaced by a summary message and every prompt is cut to
+    a token-budgeted window of the latest messages. Without a budget, only prompt sizes are measured.
+    """
+
+    def __init__(self, agent: ConversableAgent, manager: Agent, token_budget: int | None) -> None:
+        self.agent = agent
+        self.manager = manager
+        self.token_budget = token_budget
+        # Index of the first message of the current chat in the agent's history
+        self.chat_start = 0
+
+        agent.register_hook("process_all_messages_before_reply", self.window)
+
+    @property
+    def history(self) -> list[dict]:
+        return self.agent.chat_messages[self.manager]
+
+    def window(self, messages: list[dict]) -> list[dict]:
+        tokens = sum(message_tokens(message) for message in messages)
+        tracer.observe("aidd_history_tokens", tokens, agent=self.agent.name, stage="before")
+
+        if self.token_budget is not None and tokens > self.token_budget:
+            messages = self.trim(messages)
+            tokens = sum(message_tokens(message) for message in messages)
+
+        tracer.observe("aidd_history_tokens", tokens, agent=self.agent.name, stage="after")
+        return messages
+
+    def trim(self, messages: list[dict]) -> list[dict]:
+        """Keep the newest message groups that fit into the budget, plus the opening message of the current chat."""
+        groups = group_messages(messages)
+        pinned = None
+        position = 0
+        for index, group in enumerate(groups):
+            if position <= self.chat_start < position + len(group):
+                pinned = index
+            position += len(group)
+
+        kept: set[int] = {len(groups) - 1} if pinned is None else {len(groups) - 1, pinned}
+        tokens = sum(message_tokens(message) for index in kept for message in groups[index])
+        for index in reversed(range(len(groups))):
+            if index in kept:
+                continue
+            group_tokens = sum(message_tokens(message) for message in groups[index])
+            if tokens + group_tokens > self.token_budget:
+                break
+            kept.add(index)
+            tokens += group_tokens
+
+        omitted = sum(len(group) for index, group in enumerate(groups) if index not in kept)
+        window = []
+        for index, group in enumerate(groups):
+            if index in kept:
+                window.extend(group)
+            elif not window or window[-1].get("name") != "history":
+                window.append(
+                    {
+                        "role": "user",
+                        "name": "history",
+                        "content": f"[{omitted} earlier messages omitted to fit the history budget]",
+                    }
+                )
+
+        return window
+
+    def compact(self, summary: str) -> None:
+        """Replace the messages of the finished chat with its summary."""
+        history = self.history
+        if self.token_budget is not None and len(history) > self.chat_start:
+            history[self.chat_start :] = [{"role": "user", "content": f"{SUMMARY_PREFIX}{summary}"}]
+
+        self.chat_start = len(history)
+
+    def chat_messages(self) -> list[dict]:
+        return self.history[self.chat_start :]
+
+
+def describe_tool_calls(messages: list[dict]) -> list[str]:
+    calls = []
+    for message in messages:
+        for tool_call in message.get("tool_calls") or []:
+            function = tool_call["function"]
+            try:
+                arguments: Any = json.loads(function.get("arguments") or "{}")
+            except json.JSONDecodeError:
+                arguments = {}
+            # Paths identify what was touched, full file contents would defeat the summary
+            target = arguments.get("path") or arguments.get("paths") or arguments.get("packages") or ""
+            calls.append(f"{function['name']}({target})" if target else function["name"])
+
+    return calls
+
+
+def last_text(messages: list[dict]) -> str:
+    for message in reversed(messages):
+        if message.get("role") == "assistant" and message.get("content"):
+            return message["content"]
+
+    return ""
+
+
+def summarize_ticket(ticket: Ticket, messages: list[dict]) -> str:
+    tool_calls = describe_tool_calls(messages)
+    return f"""\
+ticket {ticket.id} "{ticket.title}" ({ticket.status.value})
+Tool calls: {", ".join(tool_calls) or "none"}
+{last_text(messages)}""".strip()
+
+
+def summarize_planning(iteration: int, sprint: Sprint | None, messages: list[dict]) -> str:
+    if sprint is None:
+        return f"sprint {iteration} planning: no sprint planned."
+
+    tickets = "\n".join(f"- {ticket.id}: {ticket.title}" for ticket in sprint.tickets)
+    return f"""\
+sprint {iteration} planning ({len(messages)} messages)
+Goal: {sprint.goal}
+Tickets:
+{tickets}"""
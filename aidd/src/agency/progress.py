@@ -0,0 +1,83 @@
+"""Detection of chats that stopped making progress, to end them before they run up to `max_round`.
+
+Every message of the LLM agent is fingerprinted by its tool calls, or its text if it has none, together with the
+state it was sent in, e.g. the project tree. The same call on the same state gets the same answer, so once a
+fingerprint came up `settings.loop_repeat_limit` times the agent is going in circles. If the state did not change in
+between, it repeats itself; if it changed and came back, e.g. an edit undone and done again, it oscillates.
+"""
+
+import hashlib
+import json
+from typing import Callable
+
+from settings import settings
+from tracing import tracer
+
+
+def message_action(message: dict) -> list | str:
+    """Tool calls of the message with normalized arguments, or its text."""
+    tool_calls = message.get("tool_calls")
+    if not tool_calls:
+        return message.get("content") or ""
+
+    calls = []
+    for call in tool_calls:
+        arguments = call["function"].get("arguments") or "{}"
+        try:
+            arguments = json.loads(arguments)
+        except json.JSONDecodeError:
+            pass
+        calls.append([call["function"]["name"], arguments])
+
+    return calls
+
+
+def describe_action(action: list | str) -> str:
+    if isinstance(action, str):
+        return "the same reply"
+
+    names = ", ".join(dict.fromkeys(name for name, _ in action))
+    return f"the same {names} call" if len(action) == 1 else f"the same calls of {names}"
+
+
+class ProgressMonitor:
+    def __init__(self, phase: str, state: Callable[[], str], limit: int | None = None) -> None:
+        self.phase = phase
+        self.state = state
+        self.limit = settings.loop_repeat_limit if limit is None else limit
+
+        # Fingerprint of the action and state of every observed message, with the state alone
+        self.history: list[tuple[str, str]] = []
+        self.stop_reason: str | None = None
+        # Reasons of all stops, also of those handled without ending the chat
+        self.stops: list[str] = []
+
+    def observe(self, message: dict) -> str | None:
+        """Record a message of the LLM agent, returns the reason to end the chat once it makes no progress."""
+        if not self.limit or self.stop_reason is not None:
+            return self.stop_reason
+
+        action = message_action(message)
+        state = self.state()
+        fingerprint = hashlib.sha256(json.dumps([action, state], sort_keys=True, default=str).encode()).hexdigest()
+        self.history.append((fingerprint, state))
+
+        occurrences = [i for i, (seen, _) in enumerate(self.history) if seen == fingerprint]
+        if len(occurrences) < self.limit:
+            return None
+
+        states_between = {seen_state for _, seen_state in self.history[occurrences[0] :]}
+        kind = "repeat" if states_between == {state} else "oscillation"
+        if kind == "repeat":
+            self.stop_reason = f"{describe_action(action)} {len(occurrences)} times without any change in between"
+        else:
+            self.stop_reason = f"{describe_action(action)} {len(occurrences)} times, each time back at the same state"
+
+        self.stops.append(self.stop_reason)
+        tracer.inc("aidd_chat_early_exits_total", phase=self.phase, reason=kind)
+        print(f"No progress in the {self.phase} chat: {self.stop_reason}.")
+        return self.stop_reason
+
+    def resume(self) -> None:
+        """Observe again after the stop was handled without ending the chat, e.g. by asking the user."""
+        self.stop_reason = None
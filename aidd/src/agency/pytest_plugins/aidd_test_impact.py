@@ -0,0 +1,140 @@
+"""Pytest plugin recording which project files every test file depends on.
+
+Loaded with `-p aidd_test_impact --impact-output <path>` from the project directory, writes
+{"exitstatus": 0, "tests": {"app/test_main.py": ["app/main.py", ...]}} to the output path. Standalone, as it
+runs in the project's environment.
+
+A test file depends on the project files its tests execute and on every project module it imports, directly or
+through other modules. Modules are executed only once per session, so imports are not taken from the profile but
+from the import statements of the loaded modules.
+"""
+
+import ast
+import json
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+
+def pytest_addoption(parser: pytest.Parser) -> None:
+    group = parser.getgroup("aidd_test_impact")
+    group.addoption("--impact-output", help="Path to write the files executed per test file to.")
+    group.addoption("--impact-ignore", action="append", default=[], help="Directory names to skip.")
+
+
+def pytest_configure(config: pytest.Config) -> None:
+    output = config.getoption("impact_output")
+    if output:
+        config.pluginmanager.register(ImpactRecorder(Path(output), config.getoption("impact_ignore")))
+
+
+class ImpactRecorder:
+    def __init__(self, output: Path, ignore_dirs: list[str]) -> None:
+        self.output = output
+        self.ignore_dirs = set(ignore_dirs)
+        self.root = Path.cwd()
+
+        self.tests: dict[str, set[str]] = {}
+        self.current: set[str] | None = None
+        # Relative project path per code filename, None for files outside of the project
+        self.known: dict[str, str | None] = {}
+
+    def relative(self, filename: str) -> str | None:
+        if filename not in self.known:
+            path = Path(filename)
+            relative = None
+            if path.is_absolute() and path.is_relative_to(self.root):
+                relative = path.relative_to(self.root)
+                if self.ignore_dirs.intersection(relative.parts):
+                    relative = None
+            self.known[filename] = relative.as_posix() if relative is not None else None
+
+        return self.known[filename]
+
+    def profile(self, frame, event, arg) -> None:
+        # Module bodies count as calls too, so imports during collection are recorded
+        if event == "call" and self.current is not None:
+            relative = self.relative(frame.f_code.co_filename)
+            if relative is not None:
+                self.current.add(relative)
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_make_collect_report(self, collector: pytest.Collector):
+        if isinstance(collector, pytest.Module):
+            self.start(collector.path)
+        yield
+        self.current = None
+
+    @pytest.hookimpl(hookwrapper=True)
+    def pytest_runtest_protocol(self, item: pytest.Item):
+        self.start(item.path)
+        yield
+        self.current = None
+
+    def start(self, path: Path) -> None:
+        test_file = self.relative(str(path))
+        if test_file is not None:
+            self.current = self.tests.setdefault(test_file, {test_file})
+
+    def pytest_sessionstart(self) -> None:
+        sys.setprofile(self.profile)
+        threading.setprofile(self.profile)
+
+    def import_graph(self) -> dict[str, set[str]]:
+        """Project files imported by each loaded project module, resolved through `sys.modules`."""
+        files = {}
+        for name, module in list(sys.modules.items()):
+            filename = getattr(module, "__file__", None)
+            relative = self.relative(filename) if isinstance(filename, str) else None
+            if relative is not None and relative.endswith(".py"):
+                files[name] = relative
+
+        graph: dict[str, set[str]] = {}
+        for name, relative in files.items():
+            try:
+                tree = ast.parse((self.root / relative).read_bytes())
+            except (OSError, SyntaxError, ValueError):
+                continue
+
+            package = name if relative.endswith("__init__.py") else name.rpartition(".")[0]
+            # The packages of the module itself are imported before it
+            imported = {name}
+            for node in ast.walk(tree):
+                if isinstance(node, ast.Import):
+                    imported.update(alias.name for alias in node.names)
+                elif isinstance(node, ast.ImportFrom):
+                    base = node.module or ""
+                    if node.level:
+                        parts = package.split(".") if package else []
+                        parts = parts[: len(parts) - node.level + 1]
+                        base = ".".join([*parts, node.module] if node.module else parts)
+                    # Imported names may be submodules, e.g. `from app import models`
+                    imported.add(base)
+                    imported.update(f"{base}.{alias.name}" for alias in node.names)
+
+            # Importing a submodule runs the __init__ of its packages as well
+            prefixes = {module.rsplit(".", i)[0] for module in imported for i in range(module.count(".") + 1)}
+            graph.setdefault(relative, set()).update(files[module] for module in prefixes if module in files)
+
+        return graph
+
+    def pytest_sessionfinish(self, exitstatus: int) -> None:
+        sys.setprofile(None)
+        threading.setprofile(None)
+
+        graph = self.import_graph()
+        for test_file, files in self.tests.items():
+            visited = {test_file}
+            pending = [test_file]
+            while pending:
+                for imported in graph.get(pending.pop(), ()):
+                    if imported not in visited:
+                        visited.add(imported)
+                        pending.append(imported)
+            files.update(visited)
+
+        self.output.parent.mkdir(parents=True, exist_ok=True)
+        tests = {test: sorted(files) for test, files in self.tests.items()}
+        self.output.write_text(json.dumps({"exitstatus": int(exitstatus), "tests": tests}))
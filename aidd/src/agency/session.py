@@ -0,0 +1,167 @@
+"""Session state persisted after every ticket, so a restarted session continues where it stopped.
+
+The state holds the sprint index, the sprint being implemented with its ticket statuses, the chat histories of
+the planning and implementation groups and the position of the LLM backend. Approved sprints are recorded in the
+backlog as well. With `settings.resume`, a restarted `main.py` loads it instead of resetting the project and starts
+again at the first open ticket; the changes of a ticket interrupted by the restart are rolled back to its
+checkpoint first.
+"""
+
+import os
+import time
+from pathlib import Path
+from typing import Any
+
+from agency.checkpoints import checkpoint_store
+from agency.lpu import backend_state, restore_backend_state
+from agency.memory import HistoryCompactor
+from autogen import GroupChat, GroupChatManager
+from backlog import backlog
+from pydantic import BaseModel
+from settings import settings
+from sprint import Sprint
+
+
+class SessionState(BaseModel):
+    session_id: str
+    # Sprint being planned or implemented
+    sprint_index: int = 0
+    # Planned sprint of `sprint_index` whose tickets are implemented, None while planning
+    sprint: Sprint | None = None
+    finished: bool = False
+    chats: dict[str, dict[str, Any]] = {}
+    backend: dict[str, Any] = {}
+    saved_at: float = 0
+
+
+class ChatHistory:
+    """Messages of a group chat and the histories of its agents, by agent name."""
+
+    def __init__(self, groupchat: GroupChat, manager: GroupChatManager, memory: HistoryCompactor) -> None:
+        self.groupchat = groupchat
+        self.manager = manager
+        self.memory = memory
+
+    @property
+    def agents(self) -> dict[str, Any]:
+        return {agent.name: agent for agent in [*self.groupchat.agents, self.manager]}
+
+    def dump(self) -> dict[str, Any]:
+        return {
+            "messages": self.groupchat.messages,
+            "histories": {
+                name: {other.name: messages for other, messages in agent.chat_messages.items()}
+                for name, agent in self.agents.items()
+            },
+            "chat_start": self.memory.chat_start,
+        }
+
+    def load(self, data: dict[str, Any]) -> None:
+        agents = self.agents
+        self.groupchat.messages[:] = data["messages"]
+        for name, histories in data["histories"].items():
+            agent = agents[name]
+            agent.chat_messages.clear()
+            for other, messages in histories.items():
+                agent.chat_messages[agents[other]] = messages
+
+        self.memory.chat_start = data["chat_start"]
+
+
+chats: dict[str, ChatHistory] = {}
+state: SessionState | None = None
+
+
+def track_chat(name: str, groupchat: GroupChat, manager: GroupChatManager, memory: HistoryCompactor) -> None:
+    chats[name] = ChatHistory(groupchat, manager, memory)
+
+
+def session_path() -> Path:
+    return settings.state_dir / "session.json"
+
+
+def save() -> None:
+    """Write the state atomically, a crash while saving keeps the previous state."""
+    if state is None:
+        return
+
+    state.chats = {name: chat.dump() for name, chat in chats.items()}
+    state.backend = backend_state()
+    state.saved_at = time.time()
+
+    path = session_path()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, "w") as file:
+        file.write(state.model_dump_json())
+        file.flush()
+        os.fsync(file.fileno())
+    tmp.replace(path)
+
+
+def start(session_id: str) -> SessionState:
+    global state
+    state = SessionState(session_id=session_id)
+    save()
+    return state
+
+
+def resume() -> SessionState | None:
+    """Load the stored state of an unfinished session, None if there is none."""
+    global state
+    path = session_path()
+    if not path.is_file():
+        return None
+
+    loaded = SessionState.model_validate_json(path.read_text())
+    if loaded.finished:
+        return None
+
+    state = loaded
+    for name, data in state.chats.items():
+        if name in chats:
+            chats[name].load(data)
+    restore_backend_state(state.backend)
+    roll_back_interrupted_ticket()
+
+    phase = "planning" if state.sprint is None else f"{len(state.sprint.open_tickets)} open tickets"
+    print(f"Resuming session {state.session_id} at sprint {state.sprint_index} ({phase}).")
+    return state
+
+
+def roll_back_interrupted_ticket() -> None:
+    """Restore the checkpoint of an open ticket that was started after the state was saved."""
+    if state.sprint is None or not settings.rollback_failed_tickets:
+        return
+
+    checkpoints = checkpoint_store.checkpoints()
+    if not checkpoints:
+        return
+
+    manifest = checkpoint_store.load(checkpoints[-1])
+    open_labels = {f"ticket_{ticket.id}" for ticket in state.sprint.open_tickets}
+    if manifest["label"] in open_labels and manifest.get("time", 0) >= state.saved_at:
+        changed = checkpoint_store.restore(checkpoints[-1])
+        print(f"Rolled back the interrupted {manifest['label']}: {', '.join(changed) or 'no files'}")
+
+
+def start_sprint(planned: Sprint) -> None:
+    state.sprint = planned
+    backlog.record_sprint(
+        state.session_id,
+        state.sprint_index,
+        planned.goal,
+        [ticket.model_dump(mode="json") for ticket in planned.tickets],
+    )
+    save()
+
+
+def finish_sprint() -> None:
+    state.sprint_index += 1
+    state.sprint = None
+    save()
+
+
+def finish() -> None:
+    state.finished = True
+    save()
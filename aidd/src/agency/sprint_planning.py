@@ -1,6 +1,15 @@
-from agency.lpu.standard import base_config
+import json
+from datetime import datetime
+
+from agency import session
+from agency.lpu import base_config, response_cache, setup_agent, setup_human
+from agency.memory import HistoryCompactor, summarize_planning
+from agency.progress import ProgressMonitor
 from autogen import Agent, AssistantAgent, GroupChat, GroupChatManager, UserProxyAgent
-from sprint import Sprint, Ticket, TicketData
+from backlog import backlog
+from settings import settings
+from sprint import Sprint, Ticket, TicketData, TicketStatus
+from tracing import instrument_llm, instrument_tools, traced_chat
 
 planning_proxy = UserProxyAgent(
     name="SprintPlan",
@@ -18,6 +27,7 @@ Factor in the project description, the current state of the project and former s
 Each sprint has to focus on a specific goal, and the tickets should be planned accordingly.
 
 The order of the tickets in the sprint is important and will dictate the order of execution.
+Declare the IDs of tickets a ticket builds upon in its dependencies, tickets independent of each other may be executed in parallel.
 
 Instructions
 ------------
@@ -132,7 +142,47 @@ def move_ticket(id: int, new_position: int) -> str:
     return f"Ticket moved.\n\n{show_sprint_plan()}"
 
 
+@planning_proxy.register_for_execution()
+@planner.register_for_llm(
+    description="Show the tickets of all previous sprints, newest first. Optionally only those of a status, "
+    "e.g. failed tickets to plan again."
+)
+def show_backlog(status: TicketStatus | None = None) -> str:
+    tickets = backlog.tickets(status=status.value if status is not None else None)
+    counts = ", ".join(f"{count} {name}" for name, count in sorted(backlog.status_counts().items()))
+
+    return f"""\
+Backlog
+-------
+Tickets: {counts or "none"}
+
+{json.dumps(tickets, indent=2) if tickets else "No tickets found."}"""
+
+
+@planning_proxy.register_for_execution()
+@planner.register_for_llm(description="Show a ticket of a previous sprint with the history of its status.")
+def show_ticket_history(id: int) -> str:
+    ticket = backlog.ticket(id)
+    if ticket is None:
+        raise ValueError("Ticket not found.")
+
+    history = "\n".join(
+        f"- {datetime.fromtimestamp(entry['time']):%Y-%m-%d %H:%M:%S} {entry['status']}"
+        for entry in backlog.history(id)
+    )
+    return f"""\
+Ticket
+------
+{json.dumps(ticket, indent=2)}
+
+Status History
+--------------
+{history}"""
+
+
 approval_requested = False
+# Set while the user has the turn to approve the submitted plan, ending the chat there approves it
+plan_approved = False
 
 
 @planning_proxy.register_for_execution()
@@ -169,26 +219,60 @@ def abort_sprint_plan() -> str:
 
 ### Group Chat ###
 
+# Registering tools rebuilds the LLM client, so the backend is set up once all tools are known
+setup_agent(planner)
+instrument_llm(planner)
+instrument_tools(planning_proxy)
+
 user = UserProxyAgent(
     name="User",
     human_input_mode="ALWAYS",
     code_execution_config=False,
 )
+setup_human(user)
 
 
 review_requested = False
 
 
+def planning_state() -> str:
+    # Feedback of the user changes what the planner is asked for, even if the plan stays the same
+    feedback = sum(message.get("name") == user.name for message in planning_group.messages)
+    return f"{feedback}:{new_sprint.model_dump_json() if new_sprint is not None else ''}"
+
+
+planning_progress = ProgressMonitor("planning", state=planning_state)
+
+
 def speaker_selection(last_speaker: Agent, groupchat: GroupChat) -> Agent | None:
-    global approval_requested, review_requested
+    global approval_requested, review_requested, plan_approved
     if review_requested:
         return user
 
+    if last_speaker == user:
+        # The user answered instead of ending the chat, e.g. with feedback on the plan
+        plan_approved = False
+
     if approval_requested:
         approval_requested = False
+        plan_approved = True
+        return user
+
+    if planning_progress.stop_reason is not None:
+        # Planning only ends with the user's approval, the user decides how to go on
+        print(
+            f"""\
+USER INPUT REQUESTED
+--------------------
+The planner makes no progress: {planning_progress.stop_reason}.
+Give feedback to continue, or exit to end the planning without a sprint."""
+        )
+        planning_progress.resume()
         return user
 
     if last_speaker == planner:
+        # The proxy still executes the calls, the planner's chat history has to stay valid for the next sprint
+        planning_progress.observe(groupchat.messages[-1])
         return planning_proxy
 
     return planner
@@ -203,6 +287,10 @@ planning_group = GroupChat(
 chat_manager = GroupChatManager(
     groupchat=planning_group,
 )
+planner_memory = HistoryCompactor(
+    planner, chat_manager, token_budget=settings.history_token_budget.get(planner.name)
+)
+session.track_chat("planning", planning_group, chat_manager, planner_memory)
 
 
 ### Main Functions ###
@@ -221,29 +309,95 @@ Project Request
     )
 
 
+REVIEW_MESSAGE = "Before starting the next sprint planning, provide a detailed review of the previous sprint."
+
+
+def planning_message(iteration: int) -> str:
+    return f"Start planning sprint {iteration}. If you are happy with the sprint plan, get the user's approval."
+
+
 def plan_sprint(iteration: int) -> Sprint | None:
-    global new_sprint, review_requested
+    global new_sprint, review_requested, plan_approved, planning_progress
     # Reset result object
     new_sprint = None
     review_requested = False
+    plan_approved = False
+    planning_progress = ProgressMonitor("planning", state=planning_state)
 
     if iteration > 0:
         # Review Previous Sprint
         review_requested = True
+        with traced_chat("review", planning_group):
+            chat_manager.initiate_chat(
+                recipient=user,
+                clear_history=False,
+                cache=response_cache,
+                message=REVIEW_MESSAGE,
+            )
+        review_requested = False
+
+    # Plan Sprint
+    with traced_chat("planning", planning_group) as span:
         chat_manager.initiate_chat(
-            recipient=user,
+            recipient=planner,
             clear_history=False,
-            message="Before starting the next sprint planning, provide a detailed review of the previous sprint.",
+            cache=response_cache,
+            max_turns=100,
+            message=planning_message(iteration),
         )
+        span["no_progress"] = planning_progress.stops
+        span["approved"] = plan_approved
+
+    if not plan_approved and new_sprint is not None:
+        # Never started without approval, e.g. after the user ended a planning that made no progress
+        print("Sprint plan not approved by the user, no sprint is started.")
+        new_sprint = None
+
+    planner_memory.compact(summarize_planning(iteration, new_sprint, planner_memory.chat_messages()))
+
+    # Retrieve result object
+    return new_sprint
+
+
+async def a_plan_sprint(iteration: int) -> Sprint | None:
+    """Async variant of `plan_sprint`."""
+    global new_sprint, review_requested, plan_approved, planning_progress
+    # Reset result object
+    new_sprint = None
+    review_requested = False
+    plan_approved = False
+    planning_progress = ProgressMonitor("planning", state=planning_state)
+
+    if iteration > 0:
+        # Review Previous Sprint
+        review_requested = True
+        with traced_chat("review", planning_group):
+            await chat_manager.a_initiate_chat(
+                recipient=user,
+                clear_history=False,
+                cache=response_cache,
+                message=REVIEW_MESSAGE,
+            )
         review_requested = False
 
     # Plan Sprint
-    chat_manager.initiate_chat(
-        recipient=planner,
-        clear_history=False,
-        max_turns=100,
-        message=f"Start planning sprint {iteration}. If you are happy with the sprint plan, get the user's approval.",
-    )
+    with traced_chat("planning", planning_group) as span:
+        await chat_manager.a_initiate_chat(
+            recipient=planner,
+            clear_history=False,
+            cache=response_cache,
+            max_turns=100,
+            message=planning_message(iteration),
+        )
+        span["no_progress"] = planning_progress.stops
+        span["approved"] = plan_approved
+
+    if not plan_approved and new_sprint is not None:
+        # Never started without approval, e.g. after the user ended a planning that made no progress
+        print("Sprint plan not approved by the user, no sprint is started.")
+        new_sprint = None
+
+    planner_memory.compact(summarize_planning(iteration, new_sprint, planner_memory.chat_messages()))
 
     # Retrieve result object
     return new_sprint
@@ -0,0 +1,268 @@
+"""In-process check of written Python files, reported in the response of the file tool right away.
+
+Finds syntax errors, imports that resolve neither to a module of the project nor to an installed package, and
+names that are never defined. The checks err on the side of silence, a name or import they cannot be sure about
+is not reported. Results are cached by the file's path and content hash, the modules of the project and the
+environment generation of `tool_cache`, as imports resolve differently after a `pip_install`.
+"""
+
+import ast
+import builtins
+import hashlib
+import importlib
+import importlib.util
+import os
+import threading
+from pathlib import Path
+
+from agency import utils
+from agency.tool_cache import tool_cache
+from settings import settings
+from tracing import tracer
+
+MODULE_NAMES = {"__name__", "__file__", "__doc__", "__spec__", "__loader__", "__package__", "__builtins__", "__path__"}
+CLASS_NAMES = {"__class__", "__module__", "__qualname__"}
+# Comprehensions are no scopes here, their variables count as names of the enclosing scope
+SCOPE_NODES = (ast.Module, ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda, ast.ClassDef)
+
+
+def project_modules(root: Path) -> frozenset[str]:
+    """Dotted names of the modules and packages in the project, e.g. "app" and "app.main"."""
+    modules = set()
+    for directory, dirnames, filenames in os.walk(root):
+        dirnames[:] = [name for name in dirnames if name not in settings.ignore_dirs and name.isidentifier()]
+        package = Path(directory).relative_to(root).parts
+        if package:
+            modules.add(".".join(package))
+        modules.update(".".join((*package, name[:-3])) for name in filenames if name.endswith(".py"))
+
+    return frozenset(modules)
+
+
+### Imports ###
+
+
+def guarded_imports(tree: ast.Module) -> set[ast.AST]:
+    """Imports in `try` bodies, which usually handle a missing module themselves."""
+    return {
+        node
+        for parent in ast.walk(tree)
+        if isinstance(parent, ast.Try)
+        for statement in parent.body
+        for node in ast.walk(statement)
+        if isinstance(node, (ast.Import, ast.ImportFrom))
+    }
+
+
+def resolves(module: str, modules: frozenset[str], package: tuple[str, ...]) -> bool:
+    if module in modules or ".".join((*package, module)) in modules:
+        # Module of the project, also next to the file for scripts run from their directory
+        return True
+
+    top_level = module.split(".")[0]
+    if top_level in modules or ".".join((*package, top_level)) in modules:
+        # Missing submodule of a project package
+        return False
+
+    try:
+        # Only the top level, finding submodules of installed packages would import their parents
+        return importlib.util.find_spec(top_level) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def check_imports(tree: ast.Module, path: str, modules: frozenset[str]) -> list[str]:
+    package = Path(path).parent.parts
+    guarded = guarded_imports(tree)
+    problems = []
+    for node in ast.walk(tree):
+        if node in guarded:
+            continue
+
+        if isinstance(node, ast.Import):
+            for alias in node.names:
+                if not resolves(alias.name, modules, package):
+                    problems.append(f"{path}:{node.lineno}: cannot resolve import '{alias.name}'")
+        elif isinstance(node, ast.ImportFrom) and node.level:
+            # Relative imports must be modules of the project, the imported names may be attributes
+            base = package[: len(package) - node.level + 1]
+            if node.level - 1 > len(package):
+                problems.append(f"{path}:{node.lineno}: relative import beyond the project directory")
+                continue
+            if node.module is None:
+                continue
+
+            module = ".".join((*base, node.module))
+            if module not in modules:
+                problems.append(f"{path}:{node.lineno}: cannot resolve import '{'.' * node.level}{node.module}'")
+        elif isinstance(node, ast.ImportFrom) and node.module is not None:
+            if not resolves(node.module, modules, package):
+                problems.append(f"{path}:{node.lineno}: cannot resolve import '{node.module}'")
+
+    return problems
+
+
+### Names ###
+
+
+class Scope:
+    def __init__(self, node: ast.AST, parent: "Scope | None") -> None:
+        self.node = node
+        self.parent = parent
+        self.names: set[str] = set()
+        # Every name counts as defined, e.g. after `from module import *`
+        self.open = False
+
+    def visible(self) -> list["Scope"]:
+        """This scope and the enclosing ones whose names it sees; class bodies are not visible to their methods."""
+        scopes = [self]
+        scope = self.parent
+        while scope is not None:
+            if not isinstance(scope.node, ast.ClassDef):
+                scopes.append(scope)
+            scope = scope.parent
+
+        return scopes
+
+
+def bound_names(node: ast.AST) -> list[str]:
+    """Names bound by the node in its scope."""
+    if isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+        return [node.id]
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+        return [node.name]
+    if isinstance(node, (ast.Import, ast.ImportFrom)):
+        return [(alias.asname or alias.name).split(".")[0] for alias in node.names if alias.name != "*"]
+    if isinstance(node, (ast.Global, ast.Nonlocal)):
+        return list(node.names)
+    if isinstance(node, ast.ExceptHandler) and node.name:
+        return [node.name]
+    if isinstance(node, (ast.MatchAs, ast.MatchStar)) and node.name:
+        return [node.name]
+    if isinstance(node, ast.MatchMapping) and node.rest:
+        return [node.rest]
+    if isinstance(node, ast.arg):
+        return [node.arg]
+
+    return []
+
+
+def check_names(tree: ast.Module, path: str) -> list[str]:
+    scopes: dict[ast.AST, Scope] = {}
+
+    def collect(node: ast.AST, scope: Scope) -> None:
+        for child in ast.iter_child_nodes(node):
+            child_scope = scope
+            if isinstance(child, SCOPE_NODES):
+                scope.names.update(bound_names(child))
+                child_scope = scopes[child] = Scope(child, scope)
+            elif isinstance(child, (ast.Global, ast.Nonlocal)):
+                # Assigned in this scope, so defined wherever the global or outer name is looked up
+                scopes[tree].names.update(child.names)
+                scope.names.update(child.names)
+            else:
+                scope.names.update(bound_names(child))
+
+            if isinstance(child, ast.ImportFrom) and any(alias.name == "*" for alias in child.names):
+                scope.open = True
+            collect(child, child_scope)
+
+    root = scopes[tree] = Scope(tree, None)
+    collect(tree, root)
+
+    known = set(dir(builtins)) | MODULE_NAMES | CLASS_NAMES
+    problems = []
+    reported = set()
+
+    def check(node: ast.AST, scope: Scope) -> None:
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load) and node.id not in known:
+            defined = any(visible.open or node.id in visible.names for visible in scope.visible())
+            if not defined and node.id not in reported:
+                reported.add(node.id)
+                problems.append(f"{path}:{node.lineno}: undefined name '{node.id}'")
+
+        if node is tree or node not in scopes:
+            for child in ast.iter_child_nodes(node):
+                check(child, scope)
+            return
+
+        # Only the body runs in the new scope, decorators, defaults, annotations and bases in the enclosing one
+        for field, value in ast.iter_fields(node):
+            for child in value if isinstance(value, list) else [value]:
+                if isinstance(child, ast.AST):
+                    check(child, scopes[node] if field == "body" else scope)
+
+    check(tree, root)
+    return problems
+
+
+### Check ###
+
+
+def check_source(source: bytes, path: str, modules: frozenset[str]) -> list[str]:
+    try:
+        # Compiling also finds errors the parser accepts, e.g. `return` outside of a function
+        compile(source, path, "exec", dont_inherit=True)
+        tree = ast.parse(source, filename=path)
+    except SyntaxError as e:
+        return [f"{path}:{e.lineno}: syntax error: {e.msg}"]
+    except ValueError as e:
+        return [f"{path}: {e}"]
+
+    return check_imports(tree, path, modules) + check_names(tree, path)
+
+
+results: dict[str, list[str]] = {}
+results_lock = threading.Lock()
+checked_environment = 0
+
+
+def check_files(full_paths: list[Path]) -> list[str]:
+    """Problems of the written Python files, other files are skipped."""
+    global checked_environment
+    paths = [path for path in full_paths if path.suffix == ".py" and path.is_file()]
+    if not paths:
+        return []
+
+    root = utils.project_dir()
+    modules = project_modules(root)
+    environment = tool_cache.environment
+    if environment != checked_environment:
+        # Packages were installed since, the import system caches directory listings
+        importlib.invalidate_caches()
+        checked_environment = environment
+
+    problems = []
+    for full_path in paths:
+        path = full_path.relative_to(root).as_posix()
+        source = full_path.read_bytes()
+        key = hashlib.sha256(repr((path, sorted(modules), environment)).encode() + source).hexdigest()
+        with results_lock:
+            file_problems = results.get(key)
+
+        tracer.inc("aidd_static_checks_total", cache="hit" if file_problems is not None else "miss")
+        if file_problems is None:
+            file_problems = check_source(source, path, modules)
+            with results_lock:
+                results[key] = file_problems
+
+        problems += file_problems
+
+    return problems
+
+
+def check_response(full_paths: list[Path]) -> str:
+    """Section to append to a file tool's response, empty if nothing was found."""
+    if not settings.static_check:
+        return ""
+
+    problems = check_files(full_paths)
+    if not problems:
+        return ""
+
+    problems = "\n".join(problems)
+    return f"""
+
+Static Check
+------------
+{problems}"""
@@ -0,0 +1,322 @@
+"""Index of the Python symbols of the project: functions, classes, methods, routes, imports and call sites.
+
+Files are parsed with `ast` and only again when their mtime or size changed, the file tools report their writes
+right away. Every query checks the files of the project for changes made otherwise, e.g. by a rollback.
+"""
+
+import ast
+import os
+import re
+import threading
+from enum import Enum
+from pathlib import Path
+
+from agency import utils
+from settings import settings
+
+HTTP_METHODS = {"get", "post", "put", "patch", "delete", "head", "options", "route", "websocket", "api_route"}
+
+
+class SymbolKind(str, Enum):
+    FUNCTION = "function"
+    CLASS = "class"
+    METHOD = "method"
+    ROUTE = "route"
+    IMPORT = "import"
+    CALL = "call"
+
+
+DEFINITION_KINDS = (SymbolKind.FUNCTION, SymbolKind.CLASS, SymbolKind.METHOD)
+
+
+class Symbol:
+    def __init__(
+        self,
+        kind: SymbolKind,
+        name: str,
+        path: str,
+        line: int,
+        end_line: int,
+        detail: str,
+        scope: str = "",
+        receiver: str = "",
+    ) -> None:
+        self.kind = kind
+        # Unqualified name; routes are named by their path, call sites by the called name
+        self.name = name
+        self.path = path
+        self.line = line
+        self.end_line = end_line
+        # Signature, import target, handler of a route or caller of a call site
+        self.detail = detail
+        # Enclosing class or function, e.g. "UserService" for its methods
+        self.scope = scope
+        # Object a call site calls the name on, e.g. "self.users" for `self.users.create()`
+        self.receiver = receiver
+
+    @property
+    def qualified_name(self) -> str:
+        return f"{self.scope}.{self.name}" if self.scope else self.name
+
+    def search_names(self) -> tuple[str, ...]:
+        if self.kind in DEFINITION_KINDS:
+            return self.name, self.qualified_name
+        if self.kind == SymbolKind.IMPORT:
+            # Also found by the imported name, e.g. `User` for `U = app.models.User`
+            return self.name, self.detail
+
+        return (self.name,)
+
+    def render(self) -> str:
+        return f"{self.path}:{self.line} {self.kind.value} {self.detail}"
+
+
+class SymbolVisitor(ast.NodeVisitor):
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.symbols: list[Symbol] = []
+        self._scopes: list[ast.AST] = []
+
+    @property
+    def scope(self) -> str:
+        return ".".join(node.name for node in self._scopes)
+
+    def add(self, kind: SymbolKind, name: str, node: ast.AST, detail: str, receiver: str = "") -> None:
+        self.symbols.append(Symbol(kind, name, self.path, node.lineno, node.end_lineno, detail, self.scope, receiver))
+
+    def visit_ClassDef(self, node: ast.ClassDef) -> None:
+        bases = ", ".join(ast.unparse(base) for base in node.bases)
+        self.add(SymbolKind.CLASS, node.name, node, f"{node.name}({bases})" if bases else node.name)
+        self.visit_nested(node)
+
+    def visit_FunctionDef(self, node: ast.FunctionDef | ast.AsyncFunctionDef) -> None:
+        in_class = bool(self._scopes) and isinstance(self._scopes[-1], ast.ClassDef)
+        prefix = "async " if isinstance(node, ast.AsyncFunctionDef) else ""
+        returns = f" -> {ast.unparse(node.returns)}" if node.returns else ""
+        signature = f"{prefix}{node.name}({ast.unparse(node.args)}){returns}"
+        self.add(SymbolKind.METHOD if in_class else SymbolKind.FUNCTION, node.name, node, signature)
+
+        for decorator in node.decorator_list:
+            route = route_of(decorator)
+            if route is not None:
+                self.add(SymbolKind.ROUTE, route, decorator, f"{route} -> {node.name}")
+
+        self.visit_nested(node)
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_nested(self, node: ast.ClassDef | ast.FunctionDef | ast.AsyncFunctionDef) -> None:
+        self._scopes.append(node)
+        self.generic_visit(node)
+        self._scopes.pop()
+
+    def visit_Import(self, node: ast.Import) -> None:
+        for alias in node.names:
+            name = alias.asname or alias.name
+            self.add(SymbolKind.IMPORT, name, node, f"{name} = {alias.name}" if alias.asname else alias.name)
+
+    def visit_ImportFrom(self, node: ast.ImportFrom) -> None:
+        module = "." * node.level + (f"{node.module}." if node.module else "")
+        for alias in node.names:
+            name = alias.asname or alias.name
+            self.add(SymbolKind.IMPORT, name, node, f"{name} = {module}{alias.name}")
+
+    def visit_Call(self, node: ast.Call) -> None:
+        receiver = ""
+        if isinstance(node.func, ast.Name):
+            name = node.func.id
+        elif isinstance(node.func, ast.Attribute):
+            name = node.func.attr
+            receiver = ast.unparse(node.func.value)
+        else:
+            name = None
+
+        if name is not None:
+            detail = f"{ast.unparse(node.func)}() in {self.scope or 'module'}"
+            self.add(SymbolKind.CALL, name, node, detail, receiver)
+        self.generic_visit(node)
+
+
+def route_of(decorator: ast.expr) -> str | None:
+    """Method and path of route decorators like `@app.get("/users")` or `@router.post(path="/")`."""
+    if not isinstance(decorator, ast.Call) or not isinstance(decorator.func, ast.Attribute):
+        return None
+
+    method = decorator.func.attr
+    if method not in HTTP_METHODS:
+        return None
+
+    arguments = [*decorator.args[:1], *(keyword.value for keyword in decorator.keywords if keyword.arg == "path")]
+    paths = [argument.value for argument in arguments if isinstance(argument, ast.Constant)]
+    if not paths or not isinstance(paths[0], str):
+        return None
+
+    return f"{method.upper()} {paths[0]}"
+
+
+def module_of(path: str) -> str:
+    parts = Path(path).with_suffix("").parts
+    return ".".join(parts[:-1] if parts[-1] == "__init__" else parts)
+
+
+def calls_definition(call: Symbol, definition: Symbol, imports: dict[str, str]) -> bool:
+    """Whether the call site likely calls the definition, judged by its receiver, its scope and the imports of its
+    file (imported name to import target). Calls on objects of unknown type are not attributed."""
+    in_scope = call.path == definition.path and (
+        definition.scope in ("", call.scope) or call.scope.startswith(f"{definition.scope}.")
+    )
+    if definition.kind == SymbolKind.METHOD:
+        if call.receiver in ("self", "cls", "super()"):
+            return in_scope
+
+        # `UserService.create()`, `UserService().create()` or `user_service.create()`
+        owner = definition.scope.split(".")[-1]
+        receiver = call.receiver.split(".")[-1].removesuffix("()")
+        return receiver in (owner, re.sub(r"(?<!^)(?=[A-Z])", "_", owner).lower())
+
+    module = module_of(definition.path).split(".")[-1]
+    if call.receiver:
+        # `utils.create()` with `from app import utils` or `import app.utils`
+        target = imports.get(call.receiver)
+        return definition.scope == "" and target is not None and target.split(".")[-1] == module
+
+    if in_scope:
+        return True
+
+    # `create()` with `from app.utils import create`
+    target = imports.get(call.name, "")
+    return definition.scope == "" and target.split(".")[-2:] == [module, definition.name]
+
+
+class SymbolIndex:
+    def __init__(self, root: Path) -> None:
+        self.root = root
+        # Symbols per file relative to the root, with the mtime and size they were parsed at
+        self.files: dict[str, tuple[int, int, list[Symbol]]] = {}
+        self.errors: dict[str, str] = {}
+        self._lock = threading.RLock()
+
+    def update(self, path: Path) -> None:
+        """Reindex `path` after it was created, changed, moved or removed, directories with everything below."""
+        relative = path.relative_to(self.root).as_posix()
+        if any(part in settings.ignore_dirs for part in Path(relative).parts):
+            return
+
+        with self._lock:
+            for name in [name for name in self.files if name == relative or name.startswith(f"{relative}/")]:
+                self._forget(name)
+
+            if path.is_dir():
+                for file_path in self._python_files(path):
+                    self._parse(file_path)
+            elif path.suffix == ".py" and path.is_file():
+                self._parse(path)
+
+    def refresh(self) -> None:
+        """Parse new and changed files, forget removed ones."""
+        with self._lock:
+            seen = set()
+            for file_path in self._python_files(self.root):
+                name = file_path.relative_to(self.root).as_posix()
+                seen.add(name)
+                stat = file_path.stat()
+                indexed = self.files.get(name)
+                if indexed is None or indexed[:2] != (stat.st_mtime_ns, stat.st_size):
+                    self._parse(file_path)
+
+            for name in self.files.keys() - seen:
+                self._forget(name)
+
+    def symbols(self) -> list[Symbol]:
+        self.refresh()
+        with self._lock:
+            return [symbol for _, _, symbols in self.files.values() for symbol in symbols]
+
+    def search(self, query: str, kind: SymbolKind | None = None) -> list[Symbol]:
+        """Symbols whose name contains the query, ignoring case; exact matches first, then by path and line."""
+        query = query.lower()
+        matches = [
+            symbol
+            for symbol in self.symbols()
+            if (kind is None or symbol.kind == kind)
+            and any(query in name.lower() for name in symbol.search_names())
+        ]
+        return sorted(matches, key=lambda symbol: (symbol.name.lower() != query, symbol.path, symbol.line))
+
+    def calls(self, definition: Symbol) -> list[Symbol]:
+        """Call sites of the definition, told apart from calls of other definitions of the same name."""
+        symbols = self.symbols()
+        imports: dict[str, dict[str, str]] = {}
+        for symbol in symbols:
+            if symbol.kind == SymbolKind.IMPORT:
+                imports.setdefault(symbol.path, {})[symbol.name] = symbol.detail.split(" = ")[-1]
+
+        return sorted(
+            (
+                symbol
+                for symbol in symbols
+                if symbol.kind == SymbolKind.CALL
+                and symbol.name == definition.name
+                and calls_definition(symbol, definition, imports.get(symbol.path, {}))
+            ),
+            key=lambda symbol: (symbol.path, symbol.line),
+        )
+
+    def definitions(self, name: str) -> list[Symbol]:
+        """Functions, classes and methods of the name, either unqualified or qualified like `Class.method`."""
+        return sorted(
+            (
+                symbol
+                for symbol in self.symbols()
+                if symbol.kind in DEFINITION_KINDS and name in (symbol.name, symbol.qualified_name)
+            ),
+            key=lambda symbol: (symbol.path, symbol.line),
+        )
+
+    ### Internals ###
+
+    def _python_files(self, directory: Path) -> list[Path]:
+        files = []
+        for path, dirnames, filenames in os.walk(directory):
+            dirnames[:] = sorted(name for name in dirnames if name not in settings.ignore_dirs)
+            files += [Path(path) / name for name in sorted(filenames) if name.endswith(".py")]
+
+        return files
+
+    def _parse(self, path: Path) -> None:
+        name = path.relative_to(self.root).as_posix()
+        stat = path.stat()
+        self.errors.pop(name, None)
+        try:
+            tree = ast.parse(path.read_bytes(), filename=name)
+        except (SyntaxError, ValueError) as e:
+            self.errors[name] = f"{type(e).__name__}: {e}"
+            self.files[name] = (stat.st_mtime_ns, stat.st_size, [])
+            return
+
+        visitor = SymbolVisitor(name)
+        visitor.visit(tree)
+        self.files[name] = (stat.st_mtime_ns, stat.st_size, visitor.symbols)
+
+    def _forget(self, name: str) -> None:
+        self.files.pop(name, None)
+        self.errors.pop(name, None)
+
+
+symbol_indexes: dict[Path, SymbolIndex] = {}
+symbol_indexes_lock = threading.Lock()
+
+
+def get_symbol_index() -> SymbolIndex:
+    """Index of the current project directory, see `utils.project_dir`."""
+    root = utils.project_dir()
+    with symbol_indexes_lock:
+        if root not in symbol_indexes:
+            symbol_indexes[root] = SymbolIndex(root)
+
+        return symbol_indexes[root]
+
+
+def drop_symbol_index(root: Path) -> None:
+    with symbol_indexes_lock:
+        symbol_indexes.pop(root, None)
@@ -0,0 +1,116 @@
+"""Test impact analysis: select the tests that depend on files changed since the last passing run.
+
+Every test run records the project files each test file executes or imports, also indirectly (see
+`pytest_plugins/aidd_test_impact.py`). Affected runs only select test files that depend on a changed file, changed
+themselves or are new. A full run
+is done instead when there is no passing baseline yet, configuration files changed or after
+`settings.test_impact_full_run_every` affected runs.
+"""
+
+import hashlib
+import json
+import os
+import threading
+from pathlib import Path
+
+from agency.workspace import snapshot
+from settings import settings
+
+PLUGIN_DIR = Path(__file__).parent / "pytest_plugins"
+# Changes of these files may affect any test
+CONFIG_FILES = {"conftest.py", "pytest.ini", "pyproject.toml", "setup.cfg", "tox.ini", "requirements.txt"}
+# Exit codes of passing runs, 5 is "no tests collected"
+PASSED_EXIT_CODES = (0, 5)
+
+
+class ImpactMap:
+    """Files executed per test file and the project state of the last passing run, stored per project directory."""
+
+    def __init__(self, project_dir: Path) -> None:
+        self.project_dir = project_dir
+        key = hashlib.sha256(str(project_dir).encode()).hexdigest()[:16]
+        self.path = settings.state_dir / "test_impact" / f"{key}.json"
+        self.lock = threading.Lock()
+
+        data = json.loads(self.path.read_text()) if self.path.is_file() else {}
+        self.tests: dict[str, list[str]] = data.get("tests", {})
+        # Content hashes of the project files at the last passing full or affected run
+        self.baseline: dict[str, str] | None = data.get("baseline")
+        self.affected_runs: int = data.get("affected_runs", 0)
+
+    def changed_files(self, current: dict[str, str]) -> set[str]:
+        baseline = self.baseline or {}
+        return {path for path in baseline.keys() | current.keys() if baseline.get(path) != current.get(path)}
+
+    def select(self) -> tuple[list[str] | None, str]:
+        """Test files to run and the reason, None for a full run."""
+        if self.baseline is None or not self.tests:
+            return None, "no passing run recorded yet"
+
+        if self.affected_runs >= settings.test_impact_full_run_every:
+            return None, f"periodic full run after {self.affected_runs} affected runs"
+
+        changed = self.changed_files(snapshot(self.project_dir))
+        if any(Path(path).name in CONFIG_FILES for path in changed):
+            return None, "configuration changed"
+
+        selected = [test for test, files in self.tests.items() if test in changed or changed.intersection(files)]
+        # New test files have not been recorded yet
+        selected += [path for path in changed if is_test_file(path) and path not in self.tests]
+        selected = [path for path in selected if (self.project_dir / path).is_file()]
+        return sorted(set(selected)), f"{len(changed)} files changed since the last passing run"
+
+    def update(self, report_path: Path, mode: str, before: dict[str, str]) -> None:
+        """Merge a run's report. Passing full and affected runs move the baseline to the state they tested."""
+        if not report_path.is_file():
+            return
+
+        report = json.loads(report_path.read_text())
+        report_path.unlink()
+
+        with self.lock:
+            self.tests.update(report["tests"])
+            self.tests = {test: files for test, files in self.tests.items() if (self.project_dir / test).is_file()}
+
+            if mode != "paths" and report["exitstatus"] in PASSED_EXIT_CODES:
+                self.baseline = before
+                self.affected_runs = self.affected_runs + 1 if mode == "affected" else 0
+
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.path.write_text(
+                json.dumps({"tests": self.tests, "baseline": self.baseline, "affected_runs": self.affected_runs})
+            )
+
+
+def is_test_file(path: str) -> bool:
+    name = Path(path).name
+    return name.endswith(".py") and (name.startswith("test_") or name.endswith("_test.py"))
+
+
+impact_maps: dict[Path, ImpactMap] = {}
+impact_maps_lock = threading.Lock()
+
+
+def get_impact_map(project_dir: Path) -> ImpactMap:
+    with impact_maps_lock:
+        if project_dir not in impact_maps:
+            impact_maps[project_dir] = ImpactMap(project_dir)
+
+        return impact_maps[project_dir]
+
+
+def plugin_args(report_path: Path) -> list[str]:
+    args = ["-p", "aidd_test_impact", "--impact-output", str(report_path.resolve())]
+    for name in settings.ignore_dirs:
+        args += ["--impact-ignore", name]
+
+    return args
+
+
+def plugin_env() -> dict[str, str]:
+    """Environment for pytest processes, making the recording plugin importable."""
+    python_path = os.environ.get("PYTHONPATH")
+    return {
+        **os.environ,
+        "PYTHONPATH": f"{PLUGIN_DIR}{os.pathsep}{python_path}" if python_path else str(PLUGIN_DIR),
+    }
@@ -0,0 +1,179 @@
+"""Warm pytest workers that fork a child for every test run.
+
+A worker is started as a script in the project's Python environment and imports heavy third-party packages
+(FastAPI, pydantic, ...) once. Project modules are never imported by the worker itself, so every forked
+child imports the current state of the project while the dependencies are already in memory.
+
+Protocol: one JSON request per line on stdin {"args": [...], "cwd": "..."}, one JSON response per line on
+stdout {"exit_code": 0, "stdout": "...", "stderr": "..."}.
+"""
+
+import atexit
+import importlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+from pathlib import Path
+
+### Worker ###
+
+
+def run_forked(args: list[str], cwd: str) -> dict:
+    with tempfile.TemporaryFile() as stdout, tempfile.TemporaryFile() as stderr:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 1
+            try:
+                os.chdir(cwd)
+                os.dup2(os.open(os.devnull, os.O_RDONLY), 0)
+                os.dup2(stdout.fileno(), 1)
+                os.dup2(stderr.fileno(), 2)
+
+                import pytest
+                from _pytest.assertion.rewrite import AssertionRewritingHook
+
+                # Preloaded pytest plugins (e.g. anyio) cannot be assertion-rewritten anymore, only the project's
+                # tests need to be, so the warning cold runs do not show is dropped
+                AssertionRewritingHook._warn_already_imported = lambda self, name: None
+                exit_code = int(pytest.main(args))
+            except BaseException:
+                import traceback
+
+                traceback.print_exc()
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(exit_code)
+
+        _, status = os.waitpid(pid, 0)
+        stdout.seek(0)
+        stderr.seek(0)
+        return {
+            "exit_code": os.waitstatus_to_exitcode(status),
+            "stdout": stdout.read().decode(errors="replace"),
+            "stderr": stderr.read().decode(errors="replace"),
+        }
+
+
+def serve(preload: list[str]) -> None:
+    # The directory of this script must not shadow project modules
+    sys.path.pop(0)
+
+    # Responses use the original stdout, output of imports and the worker itself is discarded
+    responses = os.fdopen(os.dup(1), "w")
+    os.dup2(os.open(os.devnull, os.O_WRONLY), 1)
+
+    for module in ["pytest", *preload]:
+        try:
+            importlib.import_module(module)
+        except Exception:
+            # Not installed (yet), imported by the children instead
+            pass
+
+    for line in sys.stdin:
+        request = json.loads(line)
+        responses.write(json.dumps(run_forked(request["args"], request["cwd"])) + "\n")
+        responses.flush()
+
+
+### Client ###
+
+
+class TestWorkerError(Exception):
+    pass
+
+
+class TestWorker:
+    def __init__(self, preload: list[str], env: dict[str, str] | None = None) -> None:
+        self.process = subprocess.Popen(
+            [sys.executable, str(Path(__file__).resolve()), *preload],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            env=env,
+        )
+
+    def run(self, args: list[str], cwd: Path) -> dict:
+        try:
+            self.process.stdin.write(json.dumps({"args": args, "cwd": str(cwd)}) + "\n")
+            self.process.stdin.flush()
+            response = self.process.stdout.readline()
+        except OSError as e:
+            raise TestWorkerError(f"Test worker failed: {e}") from e
+
+        if not response:
+            raise TestWorkerError(f"Test worker exited with code {self.process.poll()}")
+
+        return json.loads(response)
+
+    def close(self) -> None:
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+
+
+# Idle workers are reused, concurrent test runs start additional ones
+idle_workers: list[TestWorker] = []
+workers_lock = threading.Lock()
+# Incremented whenever the installed packages change, workers of an older generation are not reused
+generation = 0
+
+
+def run_pytest(args: list[str], cwd: Path, preload: list[str], env: dict[str, str] | None = None) -> str | None:
+    """Run pytest in a warm worker and return its output like a `pytest` subprocess would.
+
+    Returns None if no worker is available on this platform or the worker failed, so the caller can fall back
+    to a cold run.
+    """
+    if not hasattr(os, "fork"):
+        return None
+
+    with workers_lock:
+        worker_generation = generation
+        worker = idle_workers.pop() if idle_workers else None
+
+    try:
+        if worker is None:
+            worker = TestWorker(preload, env)
+        result = worker.run(args, cwd)
+    except (OSError, TestWorkerError) as e:
+        print(f"{e}, running tests in a new process instead.")
+        if worker is not None:
+            worker.close()
+        return None
+
+    with workers_lock:
+        if worker_generation == generation:
+            idle_workers.append(worker)
+            worker = None
+    if worker is not None:
+        worker.close()
+
+    return result["stdout"] or result["stderr"]
+
+
+def restart_workers() -> None:
+    """Discard the workers, e.g. after packages they may have imported were installed or upgraded."""
+    global generation
+    with workers_lock:
+        generation += 1
+        workers = list(idle_workers)
+        idle_workers.clear()
+
+    for worker in workers:
+        worker.close()
+
+
+atexit.register(restart_workers)
+
+
+if __name__ == "__main__":
+    serve(preload=sys.argv[1:])
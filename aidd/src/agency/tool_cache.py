@@ -0,0 +1,119 @@
+"""Results of expensive tools keyed on their arguments and the content of the project tree.
+
+Calling `run_tests` or `pip_install` again without changing any file in between returns the previous output
+instead of running the command. Test results additionally depend on the installed packages, so every
+executed `pip_install` starts a new environment generation.
+"""
+
+import asyncio
+import functools
+import hashlib
+import inspect
+import json
+import threading
+from typing import Any, Awaitable, Callable
+
+from agency import utils
+from agency.workspace import tree_hash
+from tracing import tracer
+
+CACHED_NOTE = "(Cached result, no file of the project changed since the same call.)"
+
+
+class ToolCache:
+    def __init__(self) -> None:
+        self.results: dict[str, str] = {}
+        self.hits: dict[str, int] = {}
+        self.misses: dict[str, int] = {}
+        # Incremented whenever packages may have been installed
+        self.environment = 0
+        self._lock = threading.Lock()
+
+    def key(self, tool: str, arguments: dict[str, Any], environment: bool) -> str:
+        project_dir = utils.project_dir()
+        data = {
+            "tool": tool,
+            "arguments": arguments,
+            # Outputs mention the project directory, e.g. pytest's rootdir
+            "project_dir": str(project_dir),
+            "tree": tree_hash(project_dir),
+            "environment": self.environment if environment else None,
+        }
+        return hashlib.sha256(json.dumps(data, sort_keys=True, default=str).encode()).hexdigest()
+
+    def get(self, tool: str, key: str) -> str | None:
+        with self._lock:
+            result = self.results.get(key)
+            counter = self.hits if result is not None else self.misses
+            counter[tool] = counter.get(tool, 0) + 1
+
+        tracer.inc("aidd_tool_cache_requests_total", tool=tool, result="hit" if result is not None else "miss")
+        if result is not None:
+            print(f"Tool cache hit for {tool}, {self.hit_rate(tool):.0%} of {tool} calls served from cache.")
+
+        return result
+
+    def set(self, key: str, result: str) -> None:
+        with self._lock:
+            self.results[key] = result
+
+    def new_environment(self) -> None:
+        with self._lock:
+            self.environment += 1
+
+    def hit_rate(self, tool: str) -> float:
+        hits, misses = self.hits.get(tool, 0), self.misses.get(tool, 0)
+        return hits / (hits + misses) if hits + misses else 0.0
+
+    def summary(self) -> str:
+        tools = sorted(self.hits.keys() | self.misses.keys())
+        rates = ", ".join(
+            f"{tool} {self.hits.get(tool, 0)}/{self.hits.get(tool, 0) + self.misses.get(tool, 0)} "
+            f"({self.hit_rate(tool):.0%})"
+            for tool in tools
+        )
+        return f"Tool cache hits: {rates or 'no cached tool calls'}"
+
+
+tool_cache = ToolCache()
+
+
+def cached(
+    tool: str,
+    depends_on_environment: bool = False,
+    bypass: Callable[[dict[str, Any]], bool] = lambda arguments: False,
+    store: Callable[[str], bool] = lambda result: True,
+) -> Callable[[Callable[..., Awaitable[str]]], Callable[..., Awaitable[str]]]:
+    """Serve the async tool's result from `tool_cache` while the project tree did not change.
+
+    `bypass` decides per call whether to always execute the tool, e.g. for explicitly isolated test runs. `store`
+    decides per result whether to keep it, e.g. failed installs are tried again on the next call.
+    """
+
+    def decorator(func: Callable[..., Awaitable[str]]) -> Callable[..., Awaitable[str]]:
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        async def wrapper(*args: Any, **kwargs: Any) -> str:
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = dict(bound.arguments)
+
+            if not bypass(arguments):
+                key = await asyncio.to_thread(tool_cache.key, tool, arguments, environment=depends_on_environment)
+                result = tool_cache.get(tool, key)
+                if result is not None:
+                    return f"{result}\n{CACHED_NOTE}"
+
+            result = await func(*args, **kwargs)
+            if not store(result):
+                return result
+
+            # The tool may have changed the project, e.g. pip writing files, so the key is computed again
+            key = await asyncio.to_thread(tool_cache.key, tool, arguments, environment=depends_on_environment)
+            tool_cache.set(key, result)
+            return result
+
+        return wrapper
+
+    return decorator
@@ -1,7 +1,54 @@
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
 from pathlib import Path
+from typing import Iterator
 
 from settings import settings
 
+# Tickets worked on in parallel each use their own copy of the project directory
+current_project_dir: ContextVar[Path] = ContextVar("current_project_dir", default=settings.project_dir)
+
+
+def project_dir() -> Path:
+    return current_project_dir.get()
+
+
+@contextmanager
+def use_project_dir(path: Path) -> Iterator[None]:
+    token = current_project_dir.set(path)
+    try:
+        yield
+    finally:
+        current_project_dir.reset(token)
+
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    """Runs every call in a copy of the submitting context.
+
+    Used as default executor of the event loop, so LLM requests autogen hands off to threads keep the project
+    directory and tracing scope of the chat they belong to.
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+async def run_command(*args: str, env: dict[str, str] | None = None) -> str:
+    """Run a command in the project directory without blocking the event loop, return its stdout or stderr."""
+    process = await asyncio.create_subprocess_exec(
+        *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, cwd=project_dir(), env=env
+    )
+    stdout, stderr = await process.communicate()
+    return stdout.decode() or stderr.decode()
+
+
+def estimate_tokens(text: str) -> int:
+    # Rough approximation of OpenAI tokenizers, good enough to compare prompt sizes
+    return len(text) // 4 + 1 if text else 0
+
 
 class AccessDeniedError(Exception):
     pass
@@ -14,8 +61,8 @@ def validate_path(path: str | None = None) -> Path:
     if Path(path).is_absolute():
         raise AccessDeniedError(f"Access denied: Absolute path {path} is not allowed.")
 
-    full_path = (settings.project_dir / path).resolve()
-    if not full_path.is_relative_to(settings.project_dir):
+    full_path = (project_dir() / path).resolve()
+    if not full_path.is_relative_to(project_dir()):
         raise AccessDeniedError(f"Access denied: Attempted access outside of project directory at path: {path}")
 
     return full_path
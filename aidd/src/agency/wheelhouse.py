@@ -0,0 +1,211 @@
+"""Local wheelhouse for `pip_install`.
+
+Requirements that are already installed are answered without running pip. Everything else is installed from
+the wheels in `settings.wheelhouse_dir`, missing wheels are downloaded or built into it first (unless
+`settings.pip_offline`), so later sessions install without network access. Installs requested while pip is
+running are batched into a single pip run.
+
+Populate the wheelhouse ahead of time with `python -m agency.wheelhouse -r requirements.txt`.
+"""
+
+import argparse
+import fcntl
+import hashlib
+import importlib
+import importlib.metadata
+import subprocess
+import sys
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
+
+from packaging.requirements import InvalidRequirement, Requirement
+from settings import settings
+
+
+def read_requirements_file(path: Path) -> list[str] | None:
+    """Requirement specifiers of a requirements file, None if it uses options only pip understands."""
+    if not path.is_file():
+        return None
+
+    requirements = []
+    for line in path.read_text().splitlines():
+        line = line.split(" #", 1)[0].strip()
+        if not line or line.startswith("#"):
+            continue
+
+        if line.startswith(("-r ", "--requirement ")):
+            nested = read_requirements_file(path.parent / line.split(maxsplit=1)[1])
+            if nested is None:
+                return None
+            requirements += nested
+        elif line.startswith("-"):
+            return None
+        else:
+            requirements.append(line)
+
+    return requirements
+
+
+def parse_requirements(args: list[str], cwd: Path) -> list[str] | None:
+    """Requirement specifiers of `pip install` arguments, None if the arguments have to be passed to pip as is."""
+    requirements = []
+    arguments = iter(args)
+    for arg in arguments:
+        if arg in ("-r", "--requirement"):
+            path = next(arguments, None)
+            nested = read_requirements_file(cwd / path) if path is not None else None
+            if nested is None:
+                return None
+            requirements += nested
+        elif arg.startswith("-"):
+            return None
+        else:
+            requirements.append(arg)
+
+    for requirement in requirements:
+        try:
+            parsed = Requirement(requirement)
+        except InvalidRequirement:
+            # Local paths, archives, editable installs, ...
+            return None
+        if parsed.url:
+            return None
+
+    return requirements
+
+
+def installed_version(requirement: str) -> str | None:
+    """Installed version satisfying the requirement, None if pip has to install it."""
+    parsed = Requirement(requirement)
+    if parsed.marker is not None and not parsed.marker.evaluate():
+        return "not required in this environment"
+    if parsed.extras:
+        # The dependencies of extras are not checked here
+        return None
+
+    try:
+        version = importlib.metadata.version(parsed.name)
+    except importlib.metadata.PackageNotFoundError:
+        return None
+
+    return version if parsed.specifier.contains(version, prereleases=True) else None
+
+
+### Pip ###
+
+
+def run_pip(*args: str, cwd: Path | None = None) -> subprocess.CompletedProcess:
+    return subprocess.run(["pip", *args], capture_output=True, text=True, cwd=cwd)
+
+
+def install_from_wheelhouse(requirements: list[str]) -> tuple[str, bool]:
+    wheelhouse = str(settings.wheelhouse_dir.resolve())
+    settings.wheelhouse_dir.mkdir(parents=True, exist_ok=True)
+
+    result = run_pip("install", "--no-index", "--find-links", wheelhouse, *requirements)
+    if result.returncode != 0 and not settings.pip_offline:
+        # Fetch the missing wheels including dependencies, then install without network again
+        populate(requirements)
+        result = run_pip("install", "--no-index", "--find-links", wheelhouse, *requirements)
+        if result.returncode != 0:
+            # Packages without wheels, e.g. sdists that fail to build
+            result = run_pip("install", "--find-links", wheelhouse, *requirements)
+
+    return result.stdout or result.stderr, result.returncode == 0
+
+
+def populate(requirements: list[str]) -> str:
+    """Download or build wheels of the requirements and their dependencies into the wheelhouse."""
+    wheelhouse = str(settings.wheelhouse_dir.resolve())
+    result = run_pip("wheel", "--wheel-dir", wheelhouse, "--find-links", wheelhouse, *requirements)
+    return result.stdout or result.stderr
+
+
+class InstallBatch:
+    def __init__(self) -> None:
+        self.requirements: list[str] = []
+        self.output = ""
+        self.succeeded = False
+        self.done = threading.Event()
+
+
+# Collects the requirements of installs requested while another install is running
+pending_batch: InstallBatch | None = None
+batch_lock = threading.Lock()
+# pip must not run concurrently on the same environment
+install_lock = threading.Lock()
+# Sessions of a batch run share the environment from several processes
+environment_id = hashlib.sha256(sys.prefix.encode()).hexdigest()[:12]
+ENVIRONMENT_LOCK_FILE = Path(tempfile.gettempdir()) / f"aidd-pip-{environment_id}.lock"
+
+
+@contextmanager
+def environment_lock() -> Iterator[None]:
+    with install_lock, open(ENVIRONMENT_LOCK_FILE, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def install_batched(requirements: list[str]) -> tuple[str, bool]:
+    global pending_batch
+    with batch_lock:
+        leader = pending_batch is None
+        if leader:
+            pending_batch = InstallBatch()
+        batch = pending_batch
+        batch.requirements += requirements
+
+    if not leader:
+        batch.done.wait()
+        return batch.output, batch.succeeded
+
+    with environment_lock():
+        with batch_lock:
+            # Later requests start the next batch
+            pending_batch = None
+        try:
+            batch.output, batch.succeeded = install_from_wheelhouse(list(dict.fromkeys(batch.requirements)))
+        finally:
+            batch.done.set()
+
+    return batch.output, batch.succeeded
+
+
+def pip_install(args: list[str], cwd: Path) -> tuple[str, bool, bool]:
+    """Install like `pip install <args>` in cwd. Returns pip's output, whether pip was run at all and whether the
+    requirements are installed now."""
+    requirements = parse_requirements(args, cwd)
+    if requirements is None:
+        with environment_lock():
+            result = run_pip("install", *args, cwd=cwd)
+        return result.stdout or result.stderr, True, result.returncode == 0
+
+    importlib.invalidate_caches()
+    versions = {requirement: installed_version(requirement) for requirement in requirements}
+    missing = [requirement for requirement, version in versions.items() if version is None]
+    if not missing:
+        lines = [
+            f"Requirement already satisfied: {requirement} ({version})" for requirement, version in versions.items()
+        ]
+        return "\n".join(lines) or "No requirements to install.", False, True
+
+    output, succeeded = install_batched(missing)
+    return output, True, succeeded
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download or build wheels into the wheelhouse of pip_install.")
+    parser.add_argument("packages", nargs="*", help="Requirement specifiers.")
+    parser.add_argument("-r", "--requirement", action="append", default=[], help="Requirements file.")
+    args = parser.parse_args()
+
+    requirements = list(args.packages)
+    for path in args.requirement:
+        requirements += read_requirements_file(Path(path)) or []
+    if not requirements:
+        sys.exit("No requirements given.")
+
+    print(populate(requirements))
@@ -0,0 +1,97 @@
+import hashlib
+import os
+import shutil
+import threading
+from pathlib import Path
+
+from settings import settings
+
+# Content hash per file path with the size and mtime it was computed for, files are only hashed again
+# after they changed
+file_hashes: dict[str, tuple[int, int, str]] = {}
+file_hashes_lock = threading.Lock()
+
+
+def file_hash(path: str, stat: os.stat_result) -> str:
+    cached = file_hashes.get(path)
+    if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+        return cached[2]
+
+    with open(path, "rb") as file:
+        digest = hashlib.sha256(file.read()).hexdigest()
+    with file_hashes_lock:
+        file_hashes[path] = (stat.st_size, stat.st_mtime_ns, digest)
+
+    return digest
+
+
+def snapshot(root: Path) -> dict[str, str]:
+    """Content hashes of all files below root by relative path, skipping ignored directories."""
+    files = {}
+    for directory, dirnames, filenames in os.walk(root):
+        dirnames[:] = [name for name in dirnames if name not in settings.ignore_dirs]
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            files[Path(path).relative_to(root).as_posix()] = file_hash(path, os.stat(path))
+
+    return files
+
+
+def tree_hash(root: Path) -> str:
+    """Single hash of the paths and contents of all files below root."""
+    return hashlib.sha256(repr(sorted(snapshot(root).items())).encode()).hexdigest()
+
+
+class MergeConflictError(Exception):
+    def __init__(self, paths: list[str]) -> None:
+        super().__init__(f"Merge conflict in: {', '.join(paths)}")
+        self.paths = paths
+
+
+class Workspace:
+    """Isolated copy of the project directory whose changes can be merged back."""
+
+    def __init__(self, source: Path, directory: Path) -> None:
+        self.source = source
+        self.directory = directory
+
+    def create(self) -> None:
+        shutil.rmtree(self.directory, ignore_errors=True)
+        shutil.copytree(self.source, self.directory, ignore=shutil.ignore_patterns(*settings.ignore_dirs))
+        self.base = snapshot(self.directory)
+
+    def remove(self) -> None:
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def changes(self) -> dict[str, str | None]:
+        """New content hash of every file changed in the workspace, None for deleted files."""
+        current = snapshot(self.directory)
+        changes: dict[str, str | None] = {path: None for path in self.base.keys() - current.keys()}
+        changes.update({path: digest for path, digest in current.items() if self.base.get(path) != digest})
+        return changes
+
+    def merge(self) -> list[str]:
+        """Apply the workspace changes to the source directory and return the changed paths.
+
+        Raises `MergeConflictError` without touching the source if any changed file was modified there differently
+        since the workspace was created.
+        """
+        changes = self.changes()
+        source = snapshot(self.source)
+        conflicts = [
+            path
+            for path, digest in changes.items()
+            if source.get(path) != self.base.get(path) and source.get(path) != digest
+        ]
+        if conflicts:
+            raise MergeConflictError(sorted(conflicts))
+
+        for path, digest in changes.items():
+            target = self.source / path
+            if digest is None:
+                target.unlink(missing_ok=True)
+            else:
+                target.parent.mkdir(parents=True, exist_ok=True)
+                shutil.copy2(self.directory / path, target)
+
+        return sorted(changes)
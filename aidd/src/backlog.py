@@ -0,0 +1,171 @@
+"""SQLite store of all planned sprints and their tickets, across sessions.
+
+Ticket IDs are allocated from a counter in the database, atomically across threads and processes, so IDs stay
+unique over all sessions sharing `settings.state_dir`. Tickets are indexed by ID, status and sprint, and every
+status change is kept in the ticket's history.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Iterator
+
+from settings import settings
+
+SCHEMA = """\
+CREATE TABLE IF NOT EXISTS counters (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS sprints (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    sprint_index INTEGER NOT NULL,
+    goal TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tickets (
+    id INTEGER PRIMARY KEY,
+    sprint_id INTEGER NOT NULL REFERENCES sprints (id),
+    position INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    data TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tickets_status ON tickets (status);
+CREATE INDEX IF NOT EXISTS tickets_sprint ON tickets (sprint_id, position);
+CREATE TABLE IF NOT EXISTS ticket_history (ticket_id INTEGER NOT NULL, status TEXT NOT NULL, time REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS ticket_history_ticket ON ticket_history (ticket_id);
+"""
+
+
+class Backlog:
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._db: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """The connection shared by all threads, one at a time."""
+        with self._lock:
+            if self._db is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+                self._db.row_factory = sqlite3.Row
+                self._db.execute("PRAGMA journal_mode=WAL")
+                self._db.executescript(SCHEMA)
+
+            yield self._db
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Write transaction, other processes using the database wait for it."""
+        with self.connection() as db:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            db.execute("COMMIT")
+
+    def allocate_ticket_id(self) -> int:
+        with self.transaction() as db:
+            db.execute("INSERT OR IGNORE INTO counters (name, value) VALUES ('ticket', 0)")
+            db.execute("UPDATE counters SET value = value + 1 WHERE name = 'ticket'")
+            return db.execute("SELECT value FROM counters WHERE name = 'ticket'").fetchone()[0]
+
+    def record_sprint(self, session_id: str, sprint_index: int, goal: str, tickets: list[dict[str, Any]]) -> int:
+        """Store an approved sprint plan, tickets are given as `Ticket.model_dump(mode="json")`."""
+        now = time.time()
+        with self.transaction() as db:
+            sprint_id = db.execute(
+                "INSERT INTO sprints (session_id, sprint_index, goal, created) VALUES (?, ?, ?, ?)",
+                (session_id, sprint_index, goal, now),
+            ).lastrowid
+            for position, ticket in enumerate(tickets):
+                data = {key: value for key, value in ticket.items() if key not in ("id", "status")}
+                db.execute(
+                    "INSERT OR REPLACE INTO tickets (id, sprint_id, position, status, data, updated) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (ticket["id"], sprint_id, position, ticket["status"], json.dumps(data), now),
+                )
+                db.execute(
+                    "INSERT INTO ticket_history (ticket_id, status, time) VALUES (?, ?, ?)",
+                    (ticket["id"], ticket["status"], now),
+                )
+
+        return sprint_id
+
+    def set_status(self, ticket_id: int, status: str) -> None:
+        now = time.time()
+        with self.transaction() as db:
+            updated = db.execute(
+                "UPDATE tickets SET status = ?, updated = ? WHERE id = ? AND status != ?",
+                (status, now, ticket_id, status),
+            ).rowcount
+            if updated:
+                db.execute(
+                    "INSERT INTO ticket_history (ticket_id, status, time) VALUES (?, ?, ?)", (ticket_id, status, now)
+                )
+
+    ### Queries ###
+
+    def ticket(self, ticket_id: int) -> dict[str, Any] | None:
+        with self.connection() as db:
+            row = db.execute(
+                "SELECT tickets.*, sprints.session_id, sprints.sprint_index, sprints.goal FROM tickets "
+                "JOIN sprints ON sprints.id = tickets.sprint_id WHERE tickets.id = ?",
+                (ticket_id,),
+            ).fetchone()
+
+        return ticket_from_row(row) if row is not None else None
+
+    def tickets(
+        self, status: str | None = None, sprint_id: int | None = None, limit: int = 50
+    ) -> list[dict[str, Any]]:
+        """Newest tickets first, optionally of one status or sprint."""
+        conditions, parameters = [], []
+        if status is not None:
+            conditions.append("tickets.status = ?")
+            parameters.append(status)
+        if sprint_id is not None:
+            conditions.append("tickets.sprint_id = ?")
+            parameters.append(sprint_id)
+
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with self.connection() as db:
+            rows = db.execute(
+                "SELECT tickets.*, sprints.session_id, sprints.sprint_index, sprints.goal FROM tickets "
+                f"JOIN sprints ON sprints.id = tickets.sprint_id {where} ORDER BY tickets.id DESC LIMIT ?",
+                (*parameters, limit),
+            ).fetchall()
+
+        return [ticket_from_row(row) for row in rows]
+
+    def history(self, ticket_id: int) -> list[dict[str, Any]]:
+        with self.connection() as db:
+            rows = db.execute(
+                "SELECT status, time FROM ticket_history WHERE ticket_id = ? ORDER BY rowid", (ticket_id,)
+            ).fetchall()
+
+        return [dict(row) for row in rows]
+
+    def status_counts(self) -> dict[str, int]:
+        with self.connection() as db:
+            rows = db.execute("SELECT status, COUNT(*) FROM tickets GROUP BY status").fetchall()
+
+        return {status: count for status, count in rows}
+
+
+def ticket_from_row(row: sqlite3.Row) -> dict[str, Any]:
+    return {
+        "id": row["id"],
+        **json.loads(row["data"]),
+        "status": row["status"],
+        "sprint": {"session_id": row["session_id"], "index": row["sprint_index"], "goal": row["goal"]},
+    }
+
+
+backlog = Backlog(settings.state_dir / "backlog.sqlite3")
@@ -0,0 +1,159 @@
+"""Run the sessions of several project requests, each in its own worker process.
+
+The requests file has one JSON object per line with the project request and optionally an ID and a template
+directory:
+
+    {"id": "users", "request": "# Project: FastAPI application with CRUD ...", "template_dir": "/home/app/template"}
+
+Every project gets its own project, log and state directory below `--output`, by default a directory per run in
+`<state_dir>/batches`, which is ignored by git and by the restarts on source changes. Sessions running at the same
+time share nothing but the installed packages and the wheelhouse. Worker processes are not reused, settings and
+the agents are module-level state of a session. At the end, a summary table of the wall time, tokens and sprint and
+ticket outcomes per project is printed and written to `summary.json`.
+
+Usage
+-----
+python batch.py REQUESTS.jsonl [--output DIR] [--jobs N]
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from pathlib import Path
+
+
+def load_projects(path: Path, output: Path) -> list[dict]:
+    # Not imported at the top, spawned workers import this module before their environment is set
+    from settings import settings
+
+    projects = []
+    for number, line in enumerate(path.read_text().splitlines(), start=1):
+        if not line.strip():
+            continue
+
+        data = json.loads(line)
+        if "request" not in data:
+            raise ValueError(f"{path}:{number}: missing 'request'")
+
+        project_id = str(data.get("id") or f"project_{number}")
+        directory = (output / project_id).resolve()
+        projects.append(
+            {
+                "id": project_id,
+                "request": data["request"],
+                "directory": str(directory),
+                "env": {
+                    "PROJECT_DIR": str(directory / "code"),
+                    "LOGFILE": str(directory / "logs"),
+                    "STATE_DIR": str(directory / "state"),
+                    "TEMPLATE_DIR": str(Path(data.get("template_dir") or settings.template_dir).resolve()),
+                    # Shared, so wheels are fetched once for all projects
+                    "WHEELHOUSE_DIR": str(settings.wheelhouse_dir.resolve()),
+                    "LLM_BACKEND": settings.llm_backend,
+                    # The rate limits hold for all sessions together, not for each of them
+                    "LLM_RATE_LIMIT_FILE": str((output / "rate_limits.json").resolve()),
+                },
+            }
+        )
+
+    if len({project["id"] for project in projects}) != len(projects):
+        raise ValueError(f"{path}: project IDs are not unique")
+
+    return projects
+
+
+def run_session(project: dict) -> dict:
+    # Imported only now, settings are read from the environment on import
+    import main
+    from benchmark import results
+    from tracing import tracer
+
+    main.REQUEST = project["request"]
+    error = None
+    start = time.perf_counter()
+    try:
+        main.main()
+    except Exception:
+        error = traceback.format_exc()
+        print(error)
+
+    return {**results(tracer.spans, wall_time=time.perf_counter() - start, label=project["id"]), "error": error}
+
+
+def run_project(project: dict) -> dict:
+    """Run a whole session in this worker process, with the output going to the project's `console.log`."""
+    os.environ.update(project["env"])
+    directory = Path(project["directory"])
+    Path(project["env"]["PROJECT_DIR"]).mkdir(parents=True, exist_ok=True)
+    sys.stdout = sys.stderr = open(directory / "console.log", "w", buffering=1)
+
+    start = time.perf_counter()
+    try:
+        project_results = run_session(project)
+    except Exception:
+        # The session could not even be set up, e.g. invalid settings
+        error = traceback.format_exc()
+        print(error)
+        project_results = {"summary": {"wall_time": time.perf_counter() - start}, "error": error}
+
+    (directory / "results.json").write_text(json.dumps(project_results, indent=2))
+    return {"id": project["id"], "error": project_results["error"], **project_results["summary"]}
+
+
+def run_batch(projects: list[dict], jobs: int) -> list[dict]:
+    summaries: dict[str, dict] = {}
+    # Fresh interpreters, forked ones would inherit the imported modules of this process
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(processes=jobs, maxtasksperchild=1) as pool:
+        for summary in pool.imap_unordered(run_project, projects):
+            summaries[summary["id"]] = summary
+            outcome = "failed" if summary["error"] else "finished"
+            progress = f"{len(summaries)}/{len(projects)}"
+            print(f"Project {summary['id']} {outcome} in {summary['wall_time']:.1f}s ({progress}).")
+
+    return [summaries[project["id"]] for project in projects]
+
+
+def summary_table(summaries: list[dict]) -> str:
+    columns = [
+        ("wall_time", "time (s)", ".1f"),
+        ("prompt_tokens", "prompt tok", "d"),
+        ("completion_tokens", "compl. tok", "d"),
+        ("sprints", "sprints", "d"),
+        ("tickets_done", "done", "d"),
+        ("tickets_failed", "failed", "d"),
+    ]
+    width = max([len("project"), *(len(summary["id"]) for summary in summaries)]) + 2
+    lines = [f"{'project':<{width}}{'result':<8}" + "".join(f"{title:>12}" for _, title, _ in columns)]
+    for summary in summaries:
+        result = "error" if summary["error"] else "ok"
+        values = "".join(f"{summary.get(key, 0):>12{spec}}" for key, _, spec in columns)
+        lines.append(f"{summary['id']:<{width}}{result:<8}{values}")
+
+    totals = "".join(f"{sum(summary.get(key, 0) for summary in summaries):>12{spec}}" for key, _, spec in columns)
+    lines.append(f"{'total':<{width}}{'':<8}{totals}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("requests", type=Path, help="JSONL file of project requests.")
+    parser.add_argument("--output", type=Path, help="Directory of the projects, by default in <state_dir>/batches.")
+    parser.add_argument("--jobs", type=int, default=2, help="Number of sessions running at the same time.")
+    args = parser.parse_args()
+
+    from settings import settings
+
+    if args.output is None:
+        args.output = settings.state_dir / "batches" / time.strftime("%Y-%m-%d_%H-%M-%S")
+
+    projects = load_projects(args.requests, args.output)
+    summaries = run_batch(projects, args.jobs)
+
+    args.output.mkdir(parents=True, exist_ok=True)
+    (args.output / "summary.json").write_text(json.dumps(summaries, indent=2))
+    print(summary_table(summaries))
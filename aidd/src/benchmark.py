@@ -0,0 +1,213 @@
+"""Benchmark the sprint loop of `main.py`.
+
+Runs a full session (planning -> implementation per sprint) and stores wall times per phase, ticket, chat and
+tool call, token usage and rounds used as JSON, so runs of different commits can be compared.
+The numbers are taken from the spans recorded by `tracing.tracer`.
+
+Usage
+-----
+python benchmark.py [--output DIR] [--label NAME]
+python benchmark.py compare BASELINE.json CANDIDATE.json
+python benchmark.py reset [--files N]
+"""
+
+import os
+
+# Benchmarks replay the offline script unless a backend is chosen explicitly
+os.environ.setdefault("LLM_BACKEND", "offline")
+
+import argparse
+import json
+import shutil
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import main as session
+from settings import reset, settings
+from tracing import tracer
+
+
+def token_usage(spans: list[dict], **attributes: object) -> dict[str, int]:
+    """Sum the tokens of all LLM requests made within the phase, sprint or ticket given by the attributes."""
+    llm_spans = [
+        span
+        for span in spans
+        if span["kind"] == "llm" and all(span.get(key) == value for key, value in attributes.items())
+    ]
+    return {
+        "prompt_tokens": sum(span.get("prompt_tokens", 0) for span in llm_spans),
+        "completion_tokens": sum(span.get("completion_tokens", 0) for span in llm_spans),
+    }
+
+
+def results(spans: list[dict], wall_time: float, label: str) -> dict:
+    phases = [
+        {
+            "phase": span["name"],
+            "sprint": span["sprint"],
+            "wall_time": span["duration"],
+            **token_usage(spans, sprint=span["sprint"], phase=span["name"]),
+        }
+        for span in spans
+        if span["kind"] == "phase"
+    ]
+    chats = [
+        {
+            "phase": span["name"],
+            "sprint": span.get("sprint"),
+            "ticket_id": span.get("ticket"),
+            "wall_time": span["duration"],
+            "rounds": span["rounds"],
+            "max_round": span["max_round"],
+        }
+        for span in spans
+        if span["kind"] == "chat"
+    ]
+    tickets = [
+        {
+            "sprint": span["sprint"],
+            "ticket_id": span["ticket"],
+            "status": span.get("status"),
+            "wall_time": span["duration"],
+            "rounds": span["rounds"],
+            **token_usage(spans, ticket=span["ticket"]),
+        }
+        for span in spans
+        if span["kind"] == "chat" and span["name"] == "implementation"
+    ]
+    tool_calls = [
+        {
+            "sprint": span.get("sprint"),
+            "ticket_id": span.get("ticket"),
+            "tool": span["name"],
+            "wall_time": span["duration"],
+            "error": span["error"],
+            "response_bytes": span.get("response_bytes", 0),
+        }
+        for span in spans
+        if span["kind"] == "tool"
+    ]
+
+    tools: dict[str, dict] = {}
+    for call in tool_calls:
+        tool = tools.setdefault(call["tool"], {"calls": 0, "errors": 0, "wall_time": 0.0, "max_wall_time": 0.0})
+        tool["calls"] += 1
+        tool["errors"] += call["error"] is not None
+        tool["wall_time"] += call["wall_time"]
+        tool["max_wall_time"] = max(tool["max_wall_time"], call["wall_time"])
+
+    return {
+        "label": label,
+        "commit": git_commit(),
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "backend": settings.llm_backend,
+        "model": settings.openai_model_name,
+        "summary": {
+            "wall_time": wall_time,
+            "sprints": len([phase for phase in phases if phase["phase"] == "implementation"]),
+            "tickets_done": len([ticket for ticket in tickets if ticket["status"] == "done"]),
+            "tickets_failed": len([ticket for ticket in tickets if ticket["status"] == "failed"]),
+            "rounds": sum(chat["rounds"] for chat in chats),
+            "tool_calls": len(tool_calls),
+            "tool_time": sum(call["wall_time"] for call in tool_calls),
+            **token_usage(spans),
+        },
+        "tools": tools,
+        "phases": phases,
+        "tickets": tickets,
+        "chats": chats,
+        "tool_calls": tool_calls,
+    }
+
+
+def git_commit() -> str:
+    result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True)
+    return result.stdout.strip() or "unknown"
+
+
+def run(output: Path, label: str) -> Path:
+    start = time.perf_counter()
+    session.main()
+    run_results = results(tracer.spans, wall_time=time.perf_counter() - start, label=label)
+
+    output.mkdir(parents=True, exist_ok=True)
+    result_file = output / f"{datetime.now():%Y-%m-%d_%H-%M-%S}_{run_results['commit']}_{label}.json"
+    result_file.write_text(json.dumps(run_results, indent=2))
+
+    return result_file
+
+
+def compare(baseline_file: Path, candidate_file: Path) -> str:
+    baseline = json.loads(baseline_file.read_text())
+    candidate = json.loads(candidate_file.read_text())
+
+    def row(name: str, old: float, new: float) -> str:
+        change = f"{(new - old) / old:+.1%}" if old else "n/a"
+        return f"{name:<32}{old:>14.3f}{new:>14.3f}{change:>10}"
+
+    lines = [f"{'':<32}{baseline['commit']:>14}{candidate['commit']:>14}{'change':>10}"]
+    lines += [row(key, value, candidate["summary"].get(key, 0)) for key, value in baseline["summary"].items()]
+    lines.append("")
+    for tool in sorted(baseline["tools"].keys() | candidate["tools"].keys()):
+        old = baseline["tools"].get(tool, {}).get("wall_time", 0.0)
+        new = candidate["tools"].get(tool, {}).get("wall_time", 0.0)
+        lines.append(row(f"tool {tool} (s)", old, new))
+
+    return "\n".join(lines)
+
+
+def reset_benchmark(files: int) -> str:
+    """Time project resets of both modes on a workspace with a venv-like directory of generated files."""
+    lines = [f"{'':<32}{'full':>14}{'snapshot':>14}"]
+    timings: dict[str, list[float]] = {}
+    project_dir = settings.project_dir
+    with tempfile.TemporaryDirectory() as directory:
+        settings.project_dir = Path(directory) / "code"
+        try:
+            for mode in ("full", "snapshot"):
+                settings.reset_mode = mode
+                settings.project_dir.mkdir()
+                shutil.copytree(settings.template_dir, settings.project_dir, dirs_exist_ok=True)
+                # Changed in the session: a generated venv and an edited file
+                for i in range(files):
+                    package = settings.project_dir / "venv" / "lib" / f"package_{i // 100}"
+                    package.mkdir(parents=True, exist_ok=True)
+                    (package / f"module_{i}.py").write_text(f"VALUE = {i}\n")
+                (settings.project_dir / "generated.py").write_text("print('generated')\n")
+
+                timings[mode] = []
+                for _ in range(2):
+                    start = time.perf_counter()
+                    reset()
+                    timings[mode].append(time.perf_counter() - start)
+                shutil.rmtree(settings.project_dir)
+        finally:
+            settings.project_dir = project_dir
+
+    lines.append(f"{f'reset {files} files (s)':<32}{timings['full'][0]:>14.3f}{timings['snapshot'][0]:>14.3f}")
+    lines.append(f"{'reset unchanged (s)':<32}{timings['full'][1]:>14.3f}{timings['snapshot'][1]:>14.3f}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--output", type=Path, default=Path("benchmarks"), help="Directory of the result files.")
+    parser.add_argument("--label", default=settings.llm_backend, help="Name of the run in the result file name.")
+    subparsers = parser.add_subparsers(dest="command")
+    compare_parser = subparsers.add_parser("compare", help="Compare two result files.")
+    compare_parser.add_argument("baseline", type=Path)
+    compare_parser.add_argument("candidate", type=Path)
+    reset_parser = subparsers.add_parser("reset", help="Time project resets on a large workspace.")
+    reset_parser.add_argument("--files", type=int, default=20000, help="Number of generated files.")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        print(compare(args.baseline, args.candidate))
+    elif args.command == "reset":
+        print(reset_benchmark(args.files))
+    else:
+        result_file = run(output=args.output, label=args.label)
+        print(f"Benchmark results written to {result_file}")
@@ -0,0 +1,235 @@
+"""Session logs written by a background thread.
+
+Within `log_to`, `print` output goes to the console right away and is queued for the writer thread, which appends
+it in batches to the phase's text log and to a structured JSONL stream. Each JSONL record holds one printed
+output with its time, the tracing scope (sprint, phase, ticket, ...) and the agent or tool that printed it.
+Files growing beyond `settings.log_max_bytes` are rotated into gzip compressed backups `<name>.1.gz`,
+`<name>.2.gz`, ..., keeping `settings.log_backups` of them.
+
+Query the stream with e.g. `jq 'select(.ticket == 2 and .agent == "Coder") | .text' logs/<session>/session.jsonl`.
+"""
+
+import atexit
+import gzip
+import json
+import logging
+import queue
+import shutil
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+from typing import Any, BinaryIO, Iterator, TextIO
+
+from autogen.events.base_event import BaseEvent
+from autogen.io import IOStream
+from autogen.io.console import IOConsole
+from autogen.logger.logger_utils import get_event_logger
+
+from settings import settings
+from tracing import scope_attributes, tracer
+
+# Text log, text, JSONL stream, printing thread, time and scope attributes of a write
+QueuedText = tuple[Path, str, Path | None, int, float, dict]
+
+
+class RotatingFile:
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.file: BinaryIO = open(path, "ab")
+        self.size = self.file.tell()
+
+    def backup(self, index: int) -> Path:
+        return self.path.with_name(f"{self.path.name}.{index}.gz")
+
+    def write(self, data: bytes) -> None:
+        # Batches are not split, a file exceeds the limit by at most one batch
+        self.file.write(data)
+        self.size += len(data)
+        if self.size >= settings.log_max_bytes:
+            self.rotate()
+
+    def rotate(self) -> None:
+        self.file.close()
+        for index in range(settings.log_backups - 1, 0, -1):
+            if self.backup(index).exists():
+                self.backup(index).replace(self.backup(index + 1))
+        if settings.log_backups > 0:
+            with open(self.path, "rb") as source, gzip.open(self.backup(1), "wb") as target:
+                shutil.copyfileobj(source, target)
+
+        self.file = open(self.path, "wb")
+        self.size = 0
+
+    def flush(self) -> None:
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class LogWriter:
+    """Appends queued output to log files in a background thread.
+
+    Everything queued while the thread writes is written with one call per file, files are flushed every
+    `settings.log_flush_interval` seconds and on `sync`.
+    """
+
+    def __init__(self) -> None:
+        # Writes or events to set once everything before them is written
+        self.queue: queue.SimpleQueue[QueuedText | threading.Event] = queue.SimpleQueue()
+        self.files: dict[Path, RotatingFile] = {}
+        # Output of each thread since its last newline, printed text arrives in several writes
+        self.lines: dict[int, tuple[Path, float, dict, list[str]]] = {}
+        self.thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def write(self, path: Path, text: str, records: Path | None = None) -> None:
+        self.start()
+        self.queue.put((path, text, records, threading.get_ident(), time.time(), scope_attributes.get()))
+
+    def sync(self) -> None:
+        """Wait until everything queued so far is written, then close the files."""
+        if self.thread is None:
+            return
+
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait()
+
+    def start(self) -> None:
+        with self._lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="log-writer", daemon=True)
+                self.thread.start()
+
+    def run(self) -> None:
+        last_flush = time.monotonic()
+        while True:
+            items = []
+            try:
+                timeout = max(last_flush + settings.log_flush_interval - time.monotonic(), 0)
+                items.append(self.queue.get(timeout=timeout))
+                while True:
+                    items.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            syncs = [item for item in items if isinstance(item, threading.Event)]
+            try:
+                self.write_batch([item for item in items if not isinstance(item, threading.Event)])
+                if syncs:
+                    self.write_batch([], finish_lines=True)
+                if syncs or time.monotonic() >= last_flush + settings.log_flush_interval:
+                    for file in self.files.values():
+                        file.flush()
+                    last_flush = time.monotonic()
+                if syncs:
+                    for file in self.files.values():
+                        file.close()
+                    self.files.clear()
+            except Exception:
+                traceback.print_exc(file=sys.__stderr__)
+            finally:
+                for done in syncs:
+                    done.set()
+
+    def write_batch(self, items: list[QueuedText], finish_lines: bool = False) -> None:
+        chunks: dict[Path, list[str]] = {}
+        for path, text, records, thread, timestamp, attributes in items:
+            chunks.setdefault(path, []).append(text)
+            if records is None:
+                continue
+
+            line = self.lines.get(thread)
+            if line is not None and (line[0], line[2]) != (records, attributes):
+                # The thread printed in another scope without finishing its line
+                self.finish_line(thread, chunks)
+                line = None
+            if line is None:
+                line = self.lines[thread] = (records, timestamp, attributes, [])
+            line[3].append(text)
+            if text.endswith("\n"):
+                self.finish_line(thread, chunks)
+
+        if finish_lines:
+            for thread in list(self.lines):
+                self.finish_line(thread, chunks)
+
+        for path, texts in chunks.items():
+            if path not in self.files:
+                self.files[path] = RotatingFile(path)
+            self.files[path].write("".join(texts).encode())
+
+    def finish_line(self, thread: int, chunks: dict[Path, list[str]]) -> None:
+        records, timestamp, attributes, texts = self.lines.pop(thread)
+        text = "".join(texts).rstrip("\n")
+        if text.strip():
+            record = {"time": timestamp, **attributes, "text": text}
+            chunks.setdefault(records, []).append(json.dumps(record, default=str) + "\n")
+
+
+log_writer = LogWriter()
+atexit.register(log_writer.sync)
+
+
+class LogStream:
+    """Replaces `sys.stdout`, printing to the console and queueing the output for the current log files."""
+
+    def __init__(self, console: TextIO) -> None:
+        self.console = console
+        # Text log and JSONL stream of the current phase, output between phases only goes to the console
+        self.target: tuple[Path, Path] | None = None
+
+    def write(self, data: str) -> int:
+        self.console.write(data)
+        target = self.target
+        if target is not None:
+            log_writer.write(target[0], data, target[1])
+        return len(data)
+
+    def flush(self) -> None:
+        self.console.flush()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.console, name)
+
+
+class LogConsole(IOConsole):
+    """Console of the agents that attributes printed messages to their sender."""
+
+    def send(self, message: BaseEvent) -> None:
+        sender = getattr(getattr(message, "content", message), "sender", None)
+        with tracer.scope(agent=sender) if isinstance(sender, str) else nullcontext():
+            super().send(message)
+
+
+def install() -> LogStream:
+    """Replace stdout once, handlers keeping a reference to it then log in later phases as well."""
+    if not isinstance(sys.stdout, LogStream):
+        sys.stdout = LogStream(sys.stdout)
+        IOStream.set_global_default(LogConsole())
+        # Agent messages are printed by autogen's event logger, which keeps the stdout it was created with
+        for handler in get_event_logger().handlers:
+            if isinstance(handler, logging.StreamHandler) and handler.stream is sys.stdout.console:
+                handler.setStream(sys.stdout)
+
+    return sys.stdout
+
+
+@contextmanager
+def log_to(path: Path, records: Path) -> Iterator[None]:
+    """Copy stdout and any exception to the text log `path` and the JSONL stream `records`."""
+    stream = install()
+    stream.target = (path, records)
+    try:
+        yield
+    except BaseException:
+        log_writer.write(path, traceback.format_exc(), records)
+        raise
+    finally:
+        stream.target = None
+        log_writer.sync()
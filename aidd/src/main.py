@@ -1,10 +1,27 @@
+import asyncio
 import os
+from contextlib import contextmanager
 from datetime import datetime
-
-from agency.implementation import init_developers, run_implementation
-from agency.sprint_planning import init_planners, plan_sprint
+from pathlib import Path
+from typing import Iterator
+
+from agency import implementation, session, sprint_planning
+from agency.implementation import (
+    a_run_implementation,
+    editor_proxy,
+    init_developers,
+    register_async_tools,
+    run_implementation,
+)
+from agency.lpu import response_cache
+from agency.lpu.offline import save_transcript
+from agency.sprint_planning import a_plan_sprint, init_planners, plan_sprint
+from agency.tool_cache import tool_cache
+from agency.utils import ContextThreadPoolExecutor
+from log_writer import log_to
 from settings import reset, settings
-from tee_logging import Tee
+from sprint import Sprint
+from tracing import tracer
 
 REQUEST = """\
 # Projektbeschreibung: FastAPI-Anwendung mit CRUD-Funktionalitäten
@@ -41,39 +58,123 @@ Die API soll die folgenden Endpunkte zur Verfügung stellen:
 """
 
 
-def main():
-    reset()
+@contextmanager
+def trace_phase(phase: str, sprint: int) -> Iterator[None]:
+    with tracer.scope(sprint=sprint, phase=phase), tracer.span("phase", phase):
+        yield
+
+
+def record_transcript() -> None:
+    if settings.transcript_file is None:
+        return
+
+    save_transcript(
+        messages=sprint_planning.planning_group.messages + implementation.planning_group.messages,
+        agents=[sprint_planning.planner.name, implementation.coder.name],
+        path=settings.transcript_file,
+    )
 
+
+def start_session() -> str:
     init_planners(request=REQUEST)
     init_developers(request=REQUEST)
 
-    session_id = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    log_path = f"{settings.logfile}/{session_id}"
-    os.makedirs(log_path, exist_ok=True)
+    state = session.resume() if settings.resume else None
+    if state is None:
+        reset()
+        state = session.start(datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+
+    os.makedirs(f"{settings.logfile}/{state.session_id}", exist_ok=True)
+    return state.session_id
+
+
+def finish_sprint(i: int, sprint: Sprint) -> None:
+    session.finish_sprint()
+    record_transcript()
 
-    i = 0
+    print(
+        f"""\
+Sprint {i} finished.
+
+{sprint.model_dump_json(indent=2)}"""
+    )
+
+
+def finish_session() -> None:
+    session.finish()
+    print("Project finished.")
+    if response_cache is not None:
+        print(response_cache.summary())
+    print(tool_cache.summary())
+
+
+def main():
+    session_id = start_session()
+
+    i = session.state.sprint_index
     while True:
         log_path = f"{settings.logfile}/{session_id}/sprint_{i}"
-        with Tee(f"{log_path}.planning.log"):
-            sprint = plan_sprint(iteration=i)
-
+        records = Path(f"{settings.logfile}/{session_id}/session.jsonl")
+        # A resumed session continues the implementation of an already planned sprint
+        sprint = session.state.sprint
         if sprint is None:
-            # Project finished
-            break
+            with log_to(Path(f"{log_path}.planning.log"), records), trace_phase("planning", sprint=i):
+                sprint = plan_sprint(iteration=i)
+            tracer.export(Path(f"{settings.logfile}/{session_id}"))
+
+            if sprint is None:
+                # Project finished, or the user ended the planning without approving a sprint plan
+                record_transcript()
+                break
+            session.start_sprint(sprint)
 
-        with Tee(f"{log_path}.implementation.log"):
+        with log_to(Path(f"{log_path}.implementation.log"), records), trace_phase("implementation", sprint=i):
             run_implementation(sprint=sprint)
+        tracer.export(Path(f"{settings.logfile}/{session_id}"))
 
-        print(
-            f"""\
-Sprint {i} finished.
+        finish_sprint(i, sprint)
+        i += 1
 
-{sprint.model_dump_json(indent=2)}"""
-        )
+    finish_session()
+
+
+async def a_main():
+    """Async variant of `main`, tool calls, LLM requests and parallel tickets share one event loop."""
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ContextThreadPoolExecutor())
+    register_async_tools(editor_proxy)
+
+    session_id = await asyncio.to_thread(start_session)
+
+    i = session.state.sprint_index
+    while True:
+        log_path = f"{settings.logfile}/{session_id}/sprint_{i}"
+        records = Path(f"{settings.logfile}/{session_id}/session.jsonl")
+        # A resumed session continues the implementation of an already planned sprint
+        sprint = session.state.sprint
+        if sprint is None:
+            with log_to(Path(f"{log_path}.planning.log"), records), trace_phase("planning", sprint=i):
+                sprint = await a_plan_sprint(iteration=i)
+            await asyncio.to_thread(tracer.export, Path(f"{settings.logfile}/{session_id}"))
+
+            if sprint is None:
+                # Project finished, or the user ended the planning without approving a sprint plan
+                record_transcript()
+                break
+            session.start_sprint(sprint)
+
+        with log_to(Path(f"{log_path}.implementation.log"), records), trace_phase("implementation", sprint=i):
+            await a_run_implementation(sprint=sprint)
+        await asyncio.to_thread(tracer.export, Path(f"{settings.logfile}/{session_id}"))
+
+        finish_sprint(i, sprint)
         i += 1
 
-    print("Project finished.")
+    finish_session()
 
 
 if __name__ == "__main__":
-    main()
+    if settings.async_orchestration:
+        asyncio.run(a_main())
+    else:
+        main()
@@ -1,5 +1,10 @@
+import os
 import shutil
+import threading
+import time
+import uuid
 from pathlib import Path
+from typing import Literal
 
 from pydantic_settings import BaseSettings
 
@@ -8,11 +13,79 @@ class Settings(BaseSettings):
     project_dir: Path = Path("/home/app/code")
     template_dir: Path = Path("/home/app/template")
     ignore_dirs: list[str] = [".git", "venv", "__pycache__", ".pytest_cache"]
+    # Track changes of the project directory with watchdog instead of checking directory mtimes
+    dir_tree_watch: bool = False
 
-    openai_api_key: str
+    # "offline" serves completions from `offline_script` instead of calling OpenAI
+    llm_backend: Literal["openai", "offline"] = "openai"
+    openai_api_key: str = ""
     openai_model_name: str = "gpt-4o-mini"
+    # Another OpenAI compatible API, e.g. the stand-in server of `agency.lpu.stand_in`
+    openai_base_url: str | None = None
+    # Limits per model shared by all agents of the process, e.g.
+    # {"gpt-4o-mini": {"requests_per_minute": 500, "tokens_per_minute": 200000}}; other models are not throttled
+    llm_rate_limits: dict[str, dict[str, float]] = {}
+    # Retries of requests failing with a rate limit error
+    llm_max_retries: int = 6
+    # Rate limit state shared with other processes through this file, set by batch.py for its sessions
+    llm_rate_limit_file: Path | None = None
+    offline_script: Path = Path("offline/script.json")
+    # Record the session as an offline script to replay it later
+    transcript_file: Path | None = None
+
+    # "delta" answers file edits with the changed lines and tree changes only, "verbose" echoes the
+    # whole file and directory tree
+    edit_response_mode: Literal["delta", "verbose"] = "delta"
+    # Larger reads of files are answered in pages, continued by reading from the next line
+    read_file_max_bytes: int = 20000
+    # Check written Python files for syntax errors, unresolved imports and undefined names right away
+    static_check: bool = True
+
+    # Tickets of a sprint without dependencies between them are worked on concurrently, each in its own
+    # workspace copy of the project; 1 keeps the serial execution in the project directory
+    max_parallel_tickets: int = 1
+    # Run the session on an asyncio event loop, tests and installs run as async subprocesses
+    async_orchestration: bool = False
+    # Chats end early once the agent sent the same tool calls on the same project state, or sprint plan, this
+    # often; 0 lets chats run up to their maximum rounds
+    loop_repeat_limit: int = 3
+
+    # Run tests in forked children of a worker that keeps these packages imported, cold pytest runs otherwise
+    test_worker: bool = True
+    test_worker_preload: list[str] = ["fastapi", "fastapi.testclient", "pydantic", "httpx", "starlette"]
+    # Affected test runs after which all tests are run again, in case the recorded dependencies missed something
+    test_impact_full_run_every: int = 5
+
+    # pip_install installs from wheels in this directory, downloading missing ones into it unless offline
+    wheelhouse_dir: Path = Path(".aidd/wheelhouse")
+    pip_offline: bool = False
+
+    # "snapshot" only restores project files that differ from the template, "full" deletes and copies everything
+    reset_mode: Literal["snapshot", "full"] = "snapshot"
+
+    # Restore the project to its state before a ticket that failed; checkpoints kept for `checkpoints diff`
+    rollback_failed_tickets: bool = True
+    checkpoint_keep: int = 20
+
+    # Continue the unfinished session stored in `state_dir` after a restart instead of starting over
+    resume: bool = False
 
     logfile: str = "logs"
+    # Log files are rotated into gzip compressed backups beyond this size
+    log_max_bytes: int = 10 * 1024 * 1024
+    log_backups: int = 5
+    # Seconds between flushes of the log files while output is written
+    log_flush_interval: float = 1.0
+    state_dir: Path = Path(".aidd")
+
+    # "read_write" serves cached responses and stores new ones, "replay" fails on any cache miss
+    llm_cache_mode: Literal["off", "read_write", "replay"] = "read_write"
+    llm_cache_max_size_mb: int = 512
+    llm_cache_max_age_days: float = 30
+
+    # Token budget of the prompt history per agent name, e.g. {"Coder": 8000}. Agents without a budget keep
+    # their full history; with a budget, finished tickets and sprint plannings are replaced by summaries.
+    history_token_budget: dict[str, int] = {}
 
 
 settings = Settings()
@@ -20,6 +93,20 @@ settings = Settings()
 
 def reset() -> None:
     # Reset the project directory
+    start = time.perf_counter()
+    if settings.reset_mode == "full":
+        full_reset()
+        print(f"Project reset in {time.perf_counter() - start:.2f}s.")
+        return
+
+    restored, removed, unchanged = snapshot_reset()
+    print(
+        f"Project reset in {time.perf_counter() - start:.2f}s "
+        f"({restored} files restored, {removed} entries removed, {unchanged} unchanged)."
+    )
+
+
+def full_reset() -> None:
     for item in settings.project_dir.iterdir():
         if item.is_file():
             item.unlink()
@@ -28,4 +115,88 @@ def reset() -> None:
 
     shutil.copytree(settings.template_dir, settings.project_dir, dirs_exist_ok=True)
 
-    print("Project reset.")
+
+def snapshot_reset() -> tuple[int, int, int]:
+    """Make the project directory equal to the template, touching only what differs.
+
+    The size and mtime of the template files serve as manifest: `copy2` keeps the mtime, so a project file with
+    the same size and mtime as its template file was not changed since it was restored. Returns the number of
+    restored files, removed entries and unchanged files.
+    """
+    # Leftovers of sessions that ended before their background deletion finished
+    trash = trash_dir()
+    if trash.is_dir():
+        delete_in_background(list(trash.iterdir()))
+
+    template_dirs = {"."}
+    template_files: dict[str, os.stat_result] = {}
+    for directory, dirnames, filenames in os.walk(settings.template_dir):
+        relative = os.path.relpath(directory, settings.template_dir)
+        template_dirs.update(os.path.normpath(os.path.join(relative, name)) for name in dirnames)
+        for name in filenames:
+            template_files[os.path.normpath(os.path.join(relative, name))] = os.stat(os.path.join(directory, name))
+
+    removed = 0
+    unchanged: set[str] = set()
+    for directory, dirnames, filenames in os.walk(settings.project_dir):
+        relative = os.path.relpath(directory, settings.project_dir)
+        for name in list(dirnames):
+            if os.path.normpath(os.path.join(relative, name)) not in template_dirs:
+                discard(Path(directory) / name)
+                dirnames.remove(name)
+                removed += 1
+
+        for name in filenames:
+            path = os.path.join(directory, name)
+            template_stat = template_files.get(os.path.normpath(os.path.join(relative, name)))
+            stat = os.lstat(path)
+            if template_stat is None:
+                os.unlink(path)
+                removed += 1
+            elif (stat.st_size, stat.st_mtime_ns) == (template_stat.st_size, template_stat.st_mtime_ns):
+                unchanged.add(os.path.normpath(os.path.join(relative, name)))
+
+    restored = 0
+    for name in template_files.keys() - unchanged:
+        target = settings.project_dir / name
+        if target.is_symlink():
+            target.unlink()
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy2(settings.template_dir / name, target)
+        restored += 1
+
+    for name in template_dirs:
+        (settings.project_dir / name).mkdir(parents=True, exist_ok=True)
+
+    return restored, removed, len(unchanged)
+
+
+def discard(path: Path) -> None:
+    """Remove a directory. It is moved aside and deleted in the background if possible, e.g. a large venv."""
+    if path.is_symlink():
+        path.unlink()
+        return
+
+    try:
+        trash_dir().mkdir(exist_ok=True)
+        target = trash_dir() / uuid.uuid4().hex
+        path.rename(target)
+    except OSError:
+        # Trash on another filesystem or not writable
+        shutil.rmtree(path)
+        return
+
+    delete_in_background([target])
+
+
+def trash_dir() -> Path:
+    # Next to the project directory, renaming into it is instant on the same filesystem
+    return settings.project_dir.parent / f".{settings.project_dir.name}.trash"
+
+
+def delete_in_background(paths: list[Path]) -> None:
+    def delete() -> None:
+        for path in paths:
+            shutil.rmtree(path, ignore_errors=True)
+
+    threading.Thread(target=delete, daemon=True).start()
@@ -1,5 +1,6 @@
 from enum import Enum
 
+from backlog import backlog
 from pydantic import BaseModel, Field
 
 
@@ -15,6 +16,9 @@ class TicketData(BaseModel):
     acceptance_criteria: str = Field(
         description="The criteria that need to be met for the ticket to be considered done."
     )
+    depends_on: list[int] = Field(
+        default_factory=list, description="IDs of the tickets that have to be done before this one."
+    )
 
 
 last_ticket_id = 0
@@ -22,7 +26,8 @@ last_ticket_id = 0
 
 def auto_inc_ticket_id():
     global last_ticket_id
-    last_ticket_id += 1
+    # Allocated by the backlog, unique over all threads and sessions
+    last_ticket_id = backlog.allocate_ticket_id()
     return last_ticket_id
 
 
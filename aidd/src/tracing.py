@@ -0,0 +1,229 @@
+import functools
+import inspect
+import itertools
+import json
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Callable, Iterator
+
+from autogen import ConversableAgent
+
+METRICS = {
+    "aidd_llm_requests_total": ("counter", "LLM requests per agent."),
+    "aidd_llm_errors_total": ("counter", "Failed LLM requests per agent."),
+    "aidd_llm_duration_seconds": ("summary", "Wall time of LLM requests per agent."),
+    "aidd_llm_tokens_total": ("counter", "Prompt and completion tokens per agent."),
+    "aidd_llm_payload_bytes_total": ("counter", "Size of LLM requests and responses per agent."),
+    "aidd_llm_queue_seconds": ("summary", "Time LLM requests waited for the rate limits, per model and phase."),
+    "aidd_llm_rate_limited_total": ("counter", "LLM requests rejected by the API's rate limits, per model and phase."),
+    "aidd_tool_calls_total": ("counter", "Tool executions per agent and tool."),
+    "aidd_tool_errors_total": ("counter", "Tool executions that raised an error."),
+    "aidd_tool_duration_seconds": ("summary", "Wall time of tool executions."),
+    "aidd_tool_payload_bytes_total": ("counter", "Size of tool arguments and responses."),
+    "aidd_tool_cache_requests_total": ("counter", "Tool results looked up in the tool cache, by hit or miss."),
+    "aidd_static_checks_total": ("counter", "Static checks of written files, by cache hit or miss."),
+    "aidd_chat_duration_seconds": ("summary", "Wall time of chats per phase."),
+    "aidd_chat_early_exits_total": (
+        "counter",
+        "Chats stopped for making no progress, per phase and reason. Ticket chats end, planning asks the user.",
+    ),
+    "aidd_history_tokens": ("summary", "Estimated prompt history tokens per LLM request, before and after compaction."),
+}
+
+scope_attributes: ContextVar[dict[str, Any]] = ContextVar("scope_attributes", default={})
+current_span: ContextVar[int | None] = ContextVar("current_span", default=None)
+
+
+class Tracer:
+    """Collects timing spans and Prometheus style metrics of agents, tools and chats."""
+
+    def __init__(self) -> None:
+        self.spans: list[dict] = []
+        self.metrics: dict[str, dict[tuple, float]] = {}
+
+        self._ids = itertools.count(1)
+        self._exported = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def scope(self, **attributes: Any) -> Iterator[None]:
+        """Attach attributes (sprint, ticket, ...) to all spans started within the scope."""
+        token = scope_attributes.set({**scope_attributes.get(), **attributes})
+        try:
+            yield
+        finally:
+            scope_attributes.reset(token)
+
+    @contextmanager
+    def span(self, kind: str, name: str, **attributes: Any) -> Iterator[dict]:
+        span = {
+            "id": next(self._ids),
+            "parent_id": current_span.get(),
+            "kind": kind,
+            "name": name,
+            **scope_attributes.get(),
+            **attributes,
+            "start": time.time(),
+            "error": None,
+        }
+        token = current_span.set(span["id"])
+        start = time.perf_counter()
+        try:
+            yield span
+        except Exception as e:
+            span["error"] = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span["duration"] = time.perf_counter() - start
+            current_span.reset(token)
+            with self._lock:
+                self.spans.append(span)
+
+    def inc(self, metric: str, value: float = 1, **labels: str) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self.metrics.setdefault(metric, {})
+            series[key] = series.get(key, 0) + value
+
+    def observe(self, metric: str, value: float, **labels: str) -> None:
+        self.inc(f"{metric}_sum", value, **labels)
+        self.inc(f"{metric}_count", 1, **labels)
+
+    ### Export ###
+
+    def export(self, directory: Path) -> None:
+        """Append new spans to `traces.jsonl` and rewrite `metrics.prom` in the given directory."""
+        with self._lock:
+            spans = self.spans[self._exported :]
+            self._exported = len(self.spans)
+
+        directory.mkdir(parents=True, exist_ok=True)
+        with open(directory / "traces.jsonl", "a") as file:
+            for span in spans:
+                file.write(json.dumps(span, default=str) + "\n")
+
+        (directory / "metrics.prom").write_text(self.prometheus())
+
+    def prometheus(self) -> str:
+        lines = []
+        with self._lock:
+            metrics = {name: dict(series) for name, series in self.metrics.items()}
+
+        for name, (metric_type, description) in METRICS.items():
+            series_names = [f"{name}_sum", f"{name}_count"] if metric_type == "summary" else [name]
+            if not any(series_name in metrics for series_name in series_names):
+                continue
+
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for series_name in series_names:
+                for labels, value in sorted(metrics.get(series_name, {}).items()):
+                    label_text = ",".join(f'{key}="{value}"' for key, value in labels)
+                    lines.append(f"{series_name}{{{label_text}}} {value:g}")
+
+        return "\n".join(lines) + "\n"
+
+
+tracer = Tracer()
+
+
+### Instrumentation ###
+
+
+def instrument_llm(agent: ConversableAgent) -> None:
+    """Trace all LLM requests of the agent. Call again whenever the agent's client is rebuilt."""
+    client = agent.client
+    create = client.create
+
+    @functools.wraps(create)
+    def traced_create(**config: Any) -> Any:
+        request_bytes = len(json.dumps(config.get("messages", []), ensure_ascii=False, default=str).encode())
+        with tracer.span("llm", agent.name, request_bytes=request_bytes) as span:
+            try:
+                response = create(**config)
+            except Exception:
+                tracer.inc("aidd_llm_errors_total", agent=agent.name)
+                raise
+            finally:
+                tracer.inc("aidd_llm_requests_total", agent=agent.name)
+                tracer.inc("aidd_llm_payload_bytes_total", request_bytes, agent=agent.name, direction="request")
+
+            usage = getattr(response, "usage", None)
+            span["prompt_tokens"] = getattr(usage, "prompt_tokens", 0) or 0
+            span["completion_tokens"] = getattr(usage, "completion_tokens", 0) or 0
+            completion = client.extract_text_or_completion_object(response)
+            span["response_bytes"] = len(json.dumps(completion, ensure_ascii=False, default=str).encode())
+
+        tracer.observe("aidd_llm_duration_seconds", span["duration"], agent=agent.name)
+        tracer.inc("aidd_llm_tokens_total", span["prompt_tokens"], agent=agent.name, direction="prompt")
+        tracer.inc("aidd_llm_tokens_total", span["completion_tokens"], agent=agent.name, direction="completion")
+        tracer.inc("aidd_llm_payload_bytes_total", span["response_bytes"], agent=agent.name, direction="response")
+        return response
+
+    client.create = traced_create
+
+
+def instrument_tools(agent: ConversableAgent) -> None:
+    """Trace all functions registered for execution on the agent."""
+    agent.register_function(
+        {name: traced_tool(agent.name, name, func) for name, func in agent.function_map.items()},
+        silent_override=True,
+    )
+
+
+def traced_tool(agent_name: str, tool_name: str, func: Callable[..., Any]) -> Callable[..., Any]:
+    labels = {"agent": agent_name, "tool": tool_name}
+
+    @contextmanager
+    def tool_span(args: tuple, kwargs: dict) -> Iterator[dict]:
+        request_bytes = len(json.dumps([args, kwargs], ensure_ascii=False, default=str).encode())
+        try:
+            with tracer.span("tool", tool_name, agent=agent_name, request_bytes=request_bytes) as span:
+                # Output printed by the tool is attributed to it in the session log
+                with tracer.scope(agent=agent_name, tool=tool_name):
+                    yield span
+        except Exception:
+            tracer.inc("aidd_tool_errors_total", **labels)
+            raise
+        finally:
+            tracer.inc("aidd_tool_calls_total", **labels)
+            tracer.observe("aidd_tool_duration_seconds", span["duration"], **labels)
+            tracer.inc("aidd_tool_payload_bytes_total", request_bytes, direction="request", **labels)
+
+        tracer.inc("aidd_tool_payload_bytes_total", span["response_bytes"], direction="response", **labels)
+
+    if inspect.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(*args: Any, **kwargs: Any) -> Any:
+            with tool_span(args, kwargs) as span:
+                result = await func(*args, **kwargs)
+                span["response_bytes"] = len(str(result).encode())
+            return result
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        with tool_span(args, kwargs) as span:
+            result = func(*args, **kwargs)
+            span["response_bytes"] = len(str(result).encode())
+        return result
+
+    return wrapper
+
+
+@contextmanager
+def traced_chat(phase: str, groupchat: Any, **attributes: Any) -> Iterator[dict]:
+    """Trace a chat of the given group, recording the rounds it used."""
+    rounds = len(groupchat.messages)
+    with tracer.span("chat", phase, max_round=groupchat.max_round, **attributes) as span:
+        try:
+            yield span
+        finally:
+            span["rounds"] = len(groupchat.messages) - rounds
+
+    tracer.observe("aidd_chat_duration_seconds", span["duration"], phase=phase)